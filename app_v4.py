@@ -5,20 +5,98 @@ import dash_bootstrap_components as dbc
 from dash.dependencies import ClientsideFunction, Input, Output, State, MATCH, ALL
 from dash.exceptions import PreventUpdate
 import plotly.express as px
-import plotly.graph_objects as go
 import pandas as pd
 import json
 import pickle
 import numpy as np
 import os
+import sys
+import uuid
 from layout_functions_v1 import createH1, createP, createGraph, createElement, createBody, createDataStore
-from modal_functions_v1 import populate_header, populate_footer, make_accordion_item, populate_body
+from modal_functions_v1 import populate_header, populate_footer, make_accordion_item, populate_body, populate_panes
+from data_functions_v1 import DataRegistry, CompositeDataSource, AGGREGATIONS
+from chart_functions_v1 import CHARTS, DEFAULT_CHART, get_chart, point_budget
+from sql_functions_v1 import SQLiteDataSource
+from figure_functions_v1 import cached_figure, cached_payload, figure_cache, graph_representation, DATA_ROUTE, REPRESENTATIONS
+from store_functions_v1 import FileLayoutStore, DASHBOARD_NAME
+from element_functions_v1 import Element, check_data_spec, default_template, parse_posted_layout, diff_from_record
+from metrics_functions_v1 import CallbackMetrics, trigger_label
+from static_functions_v1 import PrecompressedStatic, STATIC_EXTENSIONS, STATIC_MIN_SIZE, choose_encoding, file_key, read_file
+from prewarm_functions_v1 import AccessCounter, PrewarmScheduler
+from snapshot_functions_v1 import SnapshotCache, render_snapshot, snapshot_key, snapshot_page, VIEW_ROUTE
+from dash.fingerprint import check_fingerprint, build_fingerprint
+import pkgutil
+import mimetypes
+from flask import request, Response, abort, g
+from flask_compress import Compress
+from urllib.parse import parse_qs
+import hashlib
+import time
 
 ###############################################################################################################
 #                                                GLOBAL VARIABLES                                             #
 ###############################################################################################################
 
-data_dict = {filename: pd.read_csv(f'data/{filename}') for filename in os.listdir('data')}
+# Upper bound (bytes) on parsed DataFrames kept in memory; idle frames are evicted LRU-first
+DATA_MEMORY_BUDGET = 512 * 1024 ** 2
+
+# Columnar binary copies of the CSVs in data/, reused across restarts while the CSV is unchanged
+DATA_CACHE_DIR = 'cache/data'
+
+# SQLite database whose tables are offered next to the CSVs (None to only use data/).
+# Charts on these tables are aggregated in the database with GROUP BY.
+DATA_SQLITE_PATH = os.environ.get('DASHBOARD_SQLITE')
+DATA_SQL_POOL_SIZE = 4
+
+data_dict = DataRegistry('data', memory_budget=DATA_MEMORY_BUDGET, cache_dir=DATA_CACHE_DIR)
+if DATA_SQLITE_PATH:
+    data_dict = CompositeDataSource(data_dict, SQLiteDataSource(DATA_SQLITE_PATH, pool_size=DATA_SQL_POOL_SIZE))
+
+# How often (ms) open dashboards check data/ for changed files
+DATA_POLL_INTERVAL = 5000
+
+# Saved dashboards; SQLiteLayoutStore('layouts/layouts.db') is a drop-in alternative
+layout_store = FileLayoutStore('layouts')
+
+# Dashboard shown when the URL has no ?dashboard=<name>
+DEFAULT_DASHBOARD = 'saved_layout'
+
+# Threads used by createBody to build the elements of a saved layout concurrently
+RENDER_WORKERS = 8
+
+# Points one chart trace may have before it is drawn with WebGL instead of SVG, and before
+# scatter plots are drawn as a density grid of DENSITY_BINS x DENSITY_BINS cells binned on the server
+SVG_POINT_BUDGET = 5000
+WEBGL_POINT_BUDGET = 100000
+DENSITY_BINS = 200
+point_budget.configure(SVG_POINT_BUDGET, WEBGL_POINT_BUDGET, DENSITY_BINS)
+
+# Callback latency / payload size histograms, served in Prometheus format on METRICS_ROUTE
+# to the addresses in METRICS_ALLOWED
+metrics = CallbackMetrics()
+METRICS_ROUTE = '/metrics'
+METRICS_ALLOWED = ('127.0.0.1', '::1')
+
+# Responses smaller than this (bytes) are sent uncompressed; levels are kept low since
+# callback responses are compressed on every request
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_BR_LEVEL = 4
+COMPRESS_GZIP_LEVEL = 6
+
+# Brotli / gzip copies of assets/ and the Dash component bundles
+static_files = PrecompressedStatic('cache/static')
+
+# Read-only HTML snapshots of saved dashboards, served on VIEW_ROUTE and re-rendered only when
+# the layout or one of its datasets changes
+snapshots = SnapshotCache('cache/snapshots')
+
+# Dashboard opens, decayed over a day, rank which dashboards get their caches warmed in the
+# background: the PREWARM_DASHBOARDS most opened ones, after startup and after data changes,
+# PREWARM_WORKERS at a time. Data is also checked for changes every PREWARM_INTERVAL seconds.
+dashboard_access = AccessCounter('cache/dashboard_access.json')
+PREWARM_DASHBOARDS = 10
+PREWARM_WORKERS = 2
+PREWARM_INTERVAL = 60
 
 element_key = {
     'h1': createH1,
@@ -31,12 +109,34 @@ element_key = {
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css', dbc.themes.BOOTSTRAP, "https://code.jquery.com/ui/1.12.1/themes/base/jquery-ui.css"]
 external_scripts = ["https://code.jquery.com/jquery-1.12.4.js", "https://code.jquery.com/ui/1.12.1/jquery-ui.js", "https://kit.fontawesome.com/5d748364e5.js"]
 
-app = dash.Dash(__name__, external_stylesheets=external_stylesheets, external_scripts = external_scripts)#, suppress_callback_exceptions=True)
+### eager_loading: saved graphs are drawn with Plotly directly by assets/test.js, so plotly.js has to be
+### loaded even when no dcc.Graph is on the page
+app = dash.Dash(__name__, external_stylesheets=external_stylesheets, external_scripts = external_scripts, eager_loading=True)#, suppress_callback_exceptions=True)
+
+### Callback and data responses are compressed per request by flask-compress, static files are
+### served from precompressed copies (see Static files below). Dash's own compress=True always
+### forces gzip only, so flask-compress is set up here instead.
+app.server.config.update(
+    COMPRESS_ALGORITHM=['br', 'gzip'],
+    COMPRESS_BR_LEVEL=COMPRESS_BR_LEVEL,
+    COMPRESS_LEVEL=COMPRESS_GZIP_LEVEL,
+    COMPRESS_MIN_SIZE=COMPRESS_MIN_SIZE
+)
+Compress(app.server)
 
-app.layout = html.Div(
+def serve_layout():
+    ### A function so each page load picks up the modal panes for the current dataset listing
+    return html.Div(
     children=[
+        dcc.Location(id='url', refresh=False),
         dcc.Store(id='memory', data="No data"),
         dcc.Store(id='data-store', data="No data"),
+        dcc.Store(id='body-update'),
+        dcc.Store(id='save-ack'),
+        dcc.Store(id='modal-type'),
+        dcc.Store(id='data-versions'),
+        dcc.Store(id='data-refresh'),
+        dcc.Interval(id='data-poll', interval=DATA_POLL_INTERVAL),
         dbc.DropdownMenu(
             id='new-element-menu',
             label='Create a new element',
@@ -44,16 +144,17 @@ app.layout = html.Div(
             className='m-3',
             children=[
                 dbc.DropdownMenuItem('Title', id={'type': 'title', 'action':'create'}),
-                dbc.DropdownMenuItem('Text', id={'type': 'text', 'action':'create'}),
-                dbc.DropdownMenuItem('Bar chart', id={'type': 'bar-chart', 'action':'create'}),
-                dbc.DropdownMenuItem('Pie chart', id={'type': 'pie-chart', 'action':'create'})
+                dbc.DropdownMenuItem('Text', id={'type': 'text', 'action':'create'})
+            ] + [
+                dbc.DropdownMenuItem(chart.label, id={'type': chart_type, 'action':'create'})
+                for chart_type, chart in CHARTS.items()
             ]
         ),
         dbc.Modal(
             [   
                 dcc.Input(id='modal-ready', value="False", type='hidden'),
                 dbc.ModalHeader(id='modal-header'),
-                dbc.ModalBody(id='modal-body'),
+                dbc.ModalBody(id='modal-body', children=populate_panes(data_dict)),
                 dbc.ModalFooter(id='modal-footer',
                     children=[
                         html.Div(
@@ -70,10 +171,13 @@ app.layout = html.Div(
             size="xl"
         ),
         dbc.Button('Save layout', id='save-but', style={'position': 'fixed', 'bottom':50,'right':110, 'zIndex': 99}),
-        html.Div(id='body', style={'height':'100vh', 'width': '100vw'}, children=[])
+        ### The plotly template graphs' data-figure leave out, applied by assets/test.js
+        html.Div(id='body', style={'height':'100vh', 'width': '100vw'}, children=[], **{'data-template': json.dumps(default_template())})
     ]
 )
 
+app.layout = serve_layout
+
 ###############################################################################################################
 #                                                  CALLBACKS                                                  #
 ###############################################################################################################
@@ -89,95 +193,121 @@ def get_input_trigger_id(ctx):
         input_trigger = ctx.triggered[0]['prop_id'].split('.')[0]
     return input_trigger
 
+def get_text_layout(text_inputs):
+    ### Mirrors updatePlotText in assets/test.js
+    title, x_title, y_title = (list(text_inputs) + [None, None, None])[:3]
+    return {
+        'title': {'text': title},
+        'xaxis': {'title': {'text': x_title}},
+        'yaxis': {'title': {'text': y_title}}
+    }
+
+def get_plot_values(states, plot):
+    return [state.get('value') for state in states if state['id']['plot'] == plot]
+
+def get_plot_chart(plot):
+    ### Panes that are not charts (text, title) build bar charts, as they always have
+    return plot if plot in CHARTS else DEFAULT_CHART
+
+def get_data_spec(plot, dataset, column_items, agg):
+    ### column_items are the pane's input-col states / inputs, with input_ids like 'x-col-dd'
+    chart_type = get_plot_chart(plot)
+    data_spec = {'df': dataset, 'chart': chart_type}
+    data_spec.update((item['id']['input_id'][:-len('-col-dd')], item.get('value')) for item in column_items if item['id']['plot'] == plot)
+    if CHARTS[chart_type].aggregations:
+        data_spec['agg'] = agg
+    return data_spec
+
+def get_dashboard_name(search):
+    name = parse_qs((search or '').lstrip('?')).get('dashboard', [DEFAULT_DASHBOARD])[0]
+    if not DASHBOARD_NAME.match(name):
+        raise PreventUpdate
+    return name
+
 
 @app.callback(
-    [Output('body', 'children'), Output('data-store', 'data')],
+    [Output('body-update', 'data'), Output('data-store', 'data'), Output('save-ack', 'data')],
     [
         Input('memory', 'data'),
-        Input('add-button', 'n_clicks'),
-        Input({'action':'delete', 'input_id':ALL},'n_clicks')
+        Input('add-button', 'n_clicks')
     ],
     [
-        State({'id':ALL, 'plot': ALL, 'type':'modal'}, 'figure'),
-        State('body', 'children'),
+        State('url', 'search'),
         State('data-store', 'data'),
+        State('modal-type', 'data'),
+        State({'type': 'input-col', 'plot': ALL, 'input_id': ALL, 'panel':'text'}, 'value'),
         State({'type': 'input', 'plot': ALL, 'input_id': ALL, 'panel':'data'}, 'value'),
         State({'type': 'input-col', 'plot': ALL, 'input_id': ALL, 'panel':'data'}, 'value'),
+        State({'type': 'input-agg', 'plot': ALL, 'input_id': ALL, 'panel':'data'}, 'value'),
     ]
 )
 def update_body(
-    stored_data, add_button_n_clicks, delete_n_clicks,
-    modal_plot, body, current_stored_data, dataframe_selection, 
-    data_inputs
+    stored_data, add_button_n_clicks,
+    search, current_stored_data, modal_type, text_inputs, dataframe_selection, 
+    data_inputs, agg_inputs
 ):
+    ### Only the elements that changed are sent to the browser, where the clientside
+    ### updateBody callback merges them into body. Deleting is handled there entirely.
 
     input_trigger = get_input_trigger_id(dash.callback_context)
-    print(input_trigger)
 
     if input_trigger == 'X':
-        return dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update
         
     elif input_trigger == 'memory' and stored_data == "":
         ### Updating layout with saved layout
-        with open('layouts/saved_layout.txt', 'r') as f:
-            stored_layout = json.load(f)
-        f.close()
+        dashboard = get_dashboard_name(search)
+        stored_layout, layout_version = layout_store.load(dashboard)
+        ### Only dashboards that exist are ranked for prewarming, as on /view
+        if stored_layout or layout_version:
+            dashboard_access.record(dashboard)
 
-        body = createBody(stored_layout['layout'], element_key, data_dict)
-        data_store = createDataStore(stored_layout['layout'])
+        timings = {}
+        body = createBody(stored_layout, element_key, data_dict, max_workers=RENDER_WORKERS, timings=timings)
+        metrics.observe_elements(timings)
+        data_store = createDataStore(stored_layout)
 
-        return body, data_store
+        return {'action': 'load', 'children': body}, data_store, dash.no_update
 
     elif input_trigger == 'memory' and stored_data != "":
-        ### Saving current layout 
-        with open('layouts/saved_layout.txt', 'w') as f:
-            json.dump({'layout': stored_data}, f)
-        f.close()
+        ### Saving current layout, either in full ({'layout': [...]}) or as an element diff from
+        ### saveLayoutTest. The browser describes elements in the old (schema 1) format, they are
+        ### validated here. save-ack tells the browser which save made it, it only diffs against those.
+        dashboard = get_dashboard_name(search)
+        if isinstance(stored_data, list) or 'layout' in stored_data:
+            stored_layout, _ = layout_store.load(dashboard)
+            posted_layout = stored_data if isinstance(stored_data, list) else stored_data['layout']
+            version = layout_store.save(dashboard, parse_posted_layout(posted_layout, stored_layout))
+        else:
+            version = layout_store.apply_diff(dashboard, diff_from_record(stored_data))
 
-        return dash.no_update, dash.no_update
+        save_id = stored_data.get('save') if isinstance(stored_data, dict) else None
+        return dash.no_update, dash.no_update, {'save': save_id, 'version': version}
 
     elif input_trigger == 'add-button' and add_button_n_clicks > 0:
-        body.append(html.Div(
-            id=f'test-graph{len(current_stored_data) + 1}',
-            className='draggable graph', 
-            children=[
-                html.Div([
-                    html.I(
-                        id={'action':'edit', 'input_id':f'test-graph{len(current_stored_data) + 3}'},
-                        className="fas fa-pencil-alt m-2 h3",
-                        style={'cursor':'pointer'}
-                    ),
-                    html.I(
-                        id={'action':'delete', 'input_id':f'test-graph{len(current_stored_data) + 3}'},
-                        className="fas fa-trash-alt m-2 h3",
-                        style={'cursor':'pointer'}
-                    )
-                ], style={'position':'absolute', 'right':0, 'zIndex':10}),
-            dcc.Graph(figure=modal_plot[0], style={'height': '100%', 'width': '100%'})
-            ])
-        )
-
-        current_stored_data[f'test-graph{len(current_stored_data) + 3}'] = {
-            'df': dataframe_selection[0],
-            'x': data_inputs[0],
-            'y': data_inputs[1],
-            'marker_color': 'purple'
-        }
-
-        return body, current_stored_data
-
-    elif input_trigger == 'add-button' and add_button_n_clicks == 0:
-        return dash.no_update, dash.no_update
+        ### Every element type's pane is in the layout, keep the inputs of the open one
+        states_list = dash.callback_context.states_list
+        text_inputs, dataframe_selection, _, agg_inputs = [get_plot_values(states, modal_type) for states in states_list[3:]]
+        data_spec = get_data_spec(modal_type, dataframe_selection[0], states_list[5], agg_inputs[0] if agg_inputs else None)
+
+        ### Nothing is added until a dataset and every column the chart reads are picked
+        element_id = f'test-graph-{uuid.uuid4().hex[:8]}'
+        try:
+            element = Element(
+                element_id, 'div', top=10, left=10, height=40, width=40,
+                layout=get_text_layout(text_inputs),
+                data=check_data_spec(dict(data_spec, marker_color='purple'))
+            )
+            created = createElement(element, element_key, data_dict)
+        except (KeyError, ValueError):
+            raise PreventUpdate
+
+        current_stored_data[element_id] = element.data
+
+        return {'action': 'add', 'children': [created]}, current_stored_data, dash.no_update
 
     else:
-        input_trigger = json.loads(input_trigger)
-        trigger_action, trigger_id = input_trigger['action'], input_trigger['input_id']
-
-        if trigger_action == 'delete':
-            body = [element for element in body if element['props']['id'] != trigger_id]
-            return body, dash.no_update
-        else:
-            return dash.no_update, dash.no_update
+        return dash.no_update, dash.no_update, dash.no_update
 
 
 
@@ -201,44 +331,54 @@ def toggle_modal(modal_ready, close_modal_n_clicks):
 
 @app.callback(
     [
-        Output('modal-xl', 'children'),
+        Output('modal-header', 'children'),
+        Output({'type':'modal-pane', 'plot':ALL}, 'style'),
+        Output({'type':'input', 'plot':ALL, 'input_id':'data-dd', 'panel':'data'}, 'value'),
+        Output({'type':'input-agg', 'plot':ALL, 'input_id':'agg-dd', 'panel':'data'}, 'value'),
+        Output({'type':'input-col', 'plot':ALL, 'input_id':ALL, 'panel':'text'}, 'value'),
+        Output('modal-type', 'data'),
         Output("modal-ready", 'value')
     ],
     [
         Input({'action': 'create', 'type': ALL}, 'n_clicks'),
         Input('add-button', 'n_clicks')
-    ],
-    [State('modal-xl', 'children')]
+    ]
 )
-def update_modal(create_element_n_clicks, add_button_n_clicks, current_modal):
+def update_modal(create_element_n_clicks, add_button_n_clicks):
+    ### The panes are prebuilt by populate_panes, opening the modal only shows the right one
+    ### and resets the inputs of that pane
     input_trigger = get_input_trigger_id(dash.callback_context)
+    no_updates = [dash.no_update] * 6
     if input_trigger == 'X':
-        return dash.no_update, dash.no_update
+        return no_updates + [dash.no_update]
 
     elif input_trigger == 'add-button':
-        return dash.no_update, "False"
+        return no_updates + ["False"]
 
     else:
         input_trigger = json.loads(input_trigger)
         trigger_action, trigger_type = input_trigger['action'], input_trigger['type']
 
-        modal_input = current_modal[0]
-        modal_header = current_modal[1]
-        modal_body = current_modal[2]
-        modal_footer = current_modal[3]
-
         if trigger_action == 'create':
-            modal_header['props']['children'] = populate_header(trigger_action, trigger_type)
-            modal_body['props']['children'] = populate_body(trigger_action=trigger_action, trigger_type=trigger_type, data_dict=data_dict)
-            modal_footer['props']['children'] = populate_footer(trigger_action)
-            
-            return [modal_input, modal_header, modal_body, modal_footer], "True"
+            outputs_list = dash.callback_context.outputs_list
+            pane_styles = [{'display': 'block' if output['id']['plot'] == trigger_type else 'none'} for output in outputs_list[1]]
+            reset = lambda outputs, value: [value if output['id']['plot'] == trigger_type else dash.no_update for output in outputs]
+
+            return [
+                populate_header(trigger_action, trigger_type),
+                pane_styles,
+                reset(outputs_list[2], None),
+                reset(outputs_list[3], AGGREGATIONS[0]),
+                reset(outputs_list[4], None),
+                trigger_type,
+                "True"
+            ]
 
         elif trigger_action == 'edit':
-            return [modal_input, modal_header, modal_body, modal_footer], "True"
+            return no_updates + ["True"]
 
         else:
-            return dash.no_update, dash.no_update
+            return no_updates + [dash.no_update]
 
 @app.callback(
     Output({'action':'collapse-card', 'key': MATCH}, 'is_open'),
@@ -261,53 +401,89 @@ def toggle_accordion(collapse_but_clicks, collapse_orig):
 )
 def update_column_selectors(dataframe_selection):
     input_trigger = get_input_trigger_id(dash.callback_context)
+    outputs = dash.callback_context.outputs_list[0]
     if input_trigger == 'X':
         return dash.no_update
+    elif dataframe_selection is None:
+        return [[]] * len(outputs), [None] * len(outputs)
     else:
-        df = data_dict[dataframe_selection]
-        column_selection = [{'label':col, 'value':col} for col in df.columns]
-        return [column_selection, column_selection], [None, None]
+        ### The chart's numeric columns (y, z, ...) only offer numeric columns (unless there are none,
+        ### count still works on any column)
+        chart = CHARTS[get_plot_chart(outputs[0]['id']['plot'])] if outputs else None
+        columns = data_dict.metadata(dataframe_selection)['columns']
+        numeric_columns = [column for column in columns if column['numeric']] or columns
+        selections = [
+            [{'label':column['name'], 'value':column['name']} for column in (numeric_columns if output['id']['input_id'][:-len('-col-dd')] in chart.numeric else columns)]
+            for output in outputs
+        ]
+        return selections, [None] * len(outputs)
 
 @app.callback(
-    Output({'id':ALL, 'plot': ALL, 'type':'modal'}, 'figure'),
+    Output({'type':'input-warning', 'plot': MATCH, 'input_id':'x-warning', 'panel':'data'}, 'children'),
+    [Input({'type':'input-col', 'plot': MATCH, 'input_id':'x-col-dd', 'panel':'data'}, 'value')],
+    [State({'type':'input', 'plot': MATCH, 'input_id':'data-dd', 'panel':'data'}, 'value')]
+)
+def warn_high_cardinality(x_selection, dataframe_selection):
+    max_groups = CHARTS[get_plot_chart(dash.callback_context.outputs_list['id']['plot'])].max_groups
+    if x_selection is None or dataframe_selection is None or max_groups is None:
+        return None
+
+    columns = {column['name']: column for column in data_dict.metadata(dataframe_selection)['columns']}
+    column = columns.get(x_selection)
+    if column is None or column['cardinality'] <= max_groups:
+        return None
+    elif column['numeric']:
+        return f"{x_selection} has {column['cardinality']:,} distinct values, the chart will be downsampled to {max_groups:,} points"
+    else:
+        return f"{x_selection} has {column['cardinality']:,} distinct values, only the largest {max_groups:,} groups will be shown"
+
+@app.callback(
+    Output({'type':'modal-data', 'plot': MATCH}, 'data'),
     [
-        Input({'type': 'input-col', 'plot': ALL, 'input_id': ALL, 'panel':'data'}, 'value'),
-        Input({'type': 'input-col', 'plot': ALL, 'input_id': ALL, 'panel':'text'}, 'value'),
+        Input({'type': 'input-col', 'plot': MATCH, 'input_id': ALL, 'panel':'data'}, 'value'),
+        Input({'type': 'input-agg', 'plot': MATCH, 'input_id': ALL, 'panel':'data'}, 'value'),
     ],
     [
-        State({'id':ALL, 'plot': ALL, 'type':'modal'}, 'figure'),
-        State({'type':'input', 'plot': ALL, 'input_id':'data-dd', 'panel':ALL}, 'value')
-
+        State({'type':'input', 'plot': MATCH, 'input_id':'data-dd', 'panel':ALL}, 'value')
     ]
 )
-def update_plot(data_inputs, text_inputs, modal_plot, dataframe_selection):
+def update_plot(data_inputs, agg_inputs, dataframe_selection):
+    ### Only the data spec reaches the server, titles are applied by the clientside updatePlotText
     input_trigger = get_input_trigger_id(dash.callback_context)
     if input_trigger == 'X':
         return dash.no_update
 
-    else:
-        input_trigger = json.loads(input_trigger)
-        trigger_panel, trigger_id = input_trigger['panel'], input_trigger['input_id']
-
-        if trigger_panel == 'data' and None not in data_inputs:
-            df = data_dict[dataframe_selection[0]]
-            modal_plot[0]['data'] = [go.Bar(x=df[data_inputs[0]], y=df[data_inputs[1]])]
-            return modal_plot
+    elif not data_inputs or None in data_inputs:
+        return []
 
-        elif trigger_panel == 'text':
-            if trigger_id == 'title':
-                modal_plot[0]['layout']['title'] = text_inputs[0]
-
-            elif trigger_id == 'x-title':
-                modal_plot[0]['layout']['xaxis']['title'] = {'text': text_inputs[1]}
-            
-            elif trigger_id == 'y-title':
-                modal_plot[0]['layout']['yaxis']['title'] = {'text': text_inputs[2]}
+    else:
+        plot = dash.callback_context.outputs_list['id']['plot']
+        data_spec = get_data_spec(plot, dataframe_selection[0], dash.callback_context.inputs_list[0], agg_inputs[0] if agg_inputs else None)
+        preview = cached_figure(data_spec, {}, data_dict)
+        return preview['data']
 
-            return modal_plot
+app.clientside_callback(
+    ClientsideFunction(
+        namespace='clientside',
+        function_name='updatePlotText'
+    ),
+    Output({'id':'new-plot', 'plot': MATCH, 'type':'modal'}, 'figure'),
+    Input({'type':'modal-data', 'plot': MATCH}, 'data'),
+    Input({'type': 'input-col', 'plot': MATCH, 'input_id': ALL, 'panel':'text'}, 'value'),
+    State({'id':'new-plot', 'plot': MATCH, 'type':'modal'}, 'figure')
+)
 
-        else: 
-            return dash.no_update
+app.clientside_callback(
+    ClientsideFunction(
+        namespace='clientside',
+        function_name='updateBody'
+    ),
+    Output('body', 'children'),
+    Input('body-update', 'data'),
+    Input({'action':'delete', 'input_id':ALL},'n_clicks'),
+    State('body', 'children'),
+    State('data-store', 'data')
+)
 
 app.clientside_callback(
     ClientsideFunction(
@@ -317,14 +493,275 @@ app.clientside_callback(
     Output('memory', 'data'),
     Input('save-but', 'n_clicks'),
     State('body', 'children'),
+    State('data-store', 'data'),
+    State('save-ack', 'data')
+)
+
+###############################################################################################################
+############################################### Data endpoint #################################################
+###############################################################################################################
+
+@app.server.route(f'{DATA_ROUTE}<path:dataset>')
+def serve_chart_data(dataset):
+    ### Chart arrays referenced by each graph's data-src, see createGraph. The query string is the
+    ### chart's data_key: its type, one parameter per column it reads and agg if it aggregates,
+    ### plus draw, the representation the graph's trace was built for (see data_url).
+    data_spec = dict(request.args.items(), df=dataset)
+    try:
+        chart = get_chart(data_spec)
+        chart.check(data_spec)
+    except ValueError:
+        abort(400)
+    if dataset not in data_dict or any(data_spec[key] not in data_dict.columns(dataset) for key in chart.columns):
+        abort(404)
+    drawn_as = request.args.get('draw') or graph_representation(data_spec, data_dict)
+    if drawn_as not in REPRESENTATIONS:
+        abort(400)
+    data_spec = chart.data_key(data_spec)
+
+    version = data_dict.version(dataset)
+    etag = hashlib.sha1(json.dumps([version, data_spec, drawn_as, point_budget.key()], sort_keys=True).encode()).hexdigest()
+    if request.args.get('v') == version:
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'no-cache'
+
+    ### flask-compress tags compressed responses as "<etag>:<encoding>"
+    if any(request.if_none_match.contains(tag) for tag in (etag, f'{etag}:br', f'{etag}:gzip')):
+        response = Response(status=304)
+    else:
+        payload = cached_payload(data_spec, data_dict, drawn_as)
+        response = Response(json.dumps(payload), mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+###############################################################################################################
+################################################## Metrics ####################################################
+###############################################################################################################
+
+metrics.add_counter('figure_cache_hits_total', 'Figure / payload cache hits', lambda: figure_cache.hits)
+metrics.add_counter('figure_cache_misses_total', 'Figure / payload cache misses', lambda: figure_cache.misses)
+metrics.add_counter('snapshot_cache_hits_total', 'Dashboard snapshots served from cache', lambda: snapshots.hits)
+metrics.add_counter('snapshot_cache_misses_total', 'Dashboard snapshots rendered', lambda: snapshots.misses)
+
+@app.server.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.server.after_request
+def record_request_metrics(response):
+    ### Every server callback goes through /_dash-update-component, labelled by the callback's function
+    if request.path == '/_dash-update-component':
+        payload = request.get_json(silent=True) or {}
+        callback = app.callback_map.get(payload.get('output'), {}).get('callback')
+        callback_name = getattr(callback, '__name__', payload.get('output'))
+        trigger = trigger_label((payload.get('changedPropIds') or [''])[0])
+    elif request.path.startswith(DATA_ROUTE):
+        callback_name, trigger = 'serve_chart_data', request.args.get('chart', DEFAULT_CHART)
+    else:
+        return response
+
+    metrics.observe(
+        callback_name,
+        trigger,
+        time.perf_counter() - g.get('request_start', time.perf_counter()),
+        request.content_length,
+        response.calculate_content_length(),
+        response.status_code
+    )
+    return response
+
+@app.server.route(METRICS_ROUTE)
+def serve_metrics():
+    if request.remote_addr not in METRICS_ALLOWED:
+        abort(403)
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+###############################################################################################################
+################################################ Static files #################################################
+###############################################################################################################
+
+ASSETS_ROUTE = app.get_asset_url('')
+COMPONENT_SUITES_ROUTE = f"{app.config.routes_pathname_prefix}_dash-component-suites/"
+
+def static_source(path):
+    ### (cache key, loader, file name, long-lived, size if known) for a static file this app serves, None otherwise
+    if path.startswith(ASSETS_ROUTE):
+        folder = os.path.realpath(app.config.assets_folder)
+        file_path = os.path.realpath(os.path.join(folder, path[len(ASSETS_ROUTE):]))
+        if not file_path.startswith(folder + os.sep) or not os.path.isfile(file_path):
+            return None
+        ### Dash links assets as <name>?m=<mtime>, so a URL always points at one version of the file
+        return file_key(file_path), lambda: read_file(file_path), file_path, 'm' in request.args, os.path.getsize(file_path)
+
+    elif path.startswith(COMPONENT_SUITES_ROUTE):
+        package_name, _, fingerprinted_path = path[len(COMPONENT_SUITES_ROUTE):].partition('/')
+        path_in_pkg, has_fingerprint = check_fingerprint(fingerprinted_path)
+        if path_in_pkg not in app.registered_paths.get(package_name, ()):
+            return None
+        version = getattr(sys.modules.get(package_name), '__version__', '')
+        return f'{package_name}/{version}/{path_in_pkg}', lambda: pkgutil.get_data(package_name, path_in_pkg), path_in_pkg, has_fingerprint, None
+
+    return None
+
+@app.server.before_request
+def serve_precompressed_static():
+    ### Answers static requests from the precompressed copies, anything else (small files,
+    ### clients without br/gzip) falls through to Dash's own handlers
+    if request.method != 'GET' or not request.path.endswith(STATIC_EXTENSIONS):
+        return None
+    encoding = choose_encoding(request.accept_encodings)
+    source = encoding and static_source(request.path)
+    if not source:
+        return None
+
+    key, load, name, long_lived, size = source
+    if size is not None and size < STATIC_MIN_SIZE:
+        return None
+
+    response = Response(static_files.get(key, encoding, load), mimetype=mimetypes.guess_type(name)[0])
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    if long_lived:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    else:
+        response.set_etag(f'{hashlib.sha1(key.encode()).hexdigest()}:{encoding}')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.make_conditional(request)
+    return response
+
+@app.server.after_request
+def cache_fingerprinted_assets(response):
+    ### Assets too small to precompress still get the long-lived headers their ?m=<mtime> URL allows
+    if request.path.startswith(ASSETS_ROUTE) and 'm' in request.args and response.status_code == 200:
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+###############################################################################################################
+################################################# Snapshots ###################################################
+###############################################################################################################
+
+PLOTLY_PACKAGE, PLOTLY_BUNDLE = 'dash_core_components', 'plotly.min.js'
+
+def plotly_script(inline):
+    ### Views load the same (precompressed, immutable) plotly.js bundle as the app, downloads carry it inline
+    if inline:
+        return f"<script>{pkgutil.get_data(PLOTLY_PACKAGE, PLOTLY_BUNDLE).decode('utf-8')}</script>"
+    package = sys.modules[PLOTLY_PACKAGE]
+    modified = int(os.stat(os.path.join(os.path.dirname(package.__file__), PLOTLY_BUNDLE)).st_mtime)
+    ### Registered here as well, a view can be the first page a worker serves
+    app.registered_paths[PLOTLY_PACKAGE].add(PLOTLY_BUNDLE)
+    return f'<script src="{COMPONENT_SUITES_ROUTE}{PLOTLY_PACKAGE}/{build_fingerprint(PLOTLY_BUNDLE, package.__version__, modified)}"></script>'
+
+@app.server.route(f'{VIEW_ROUTE}<name>')
+def serve_snapshot(name):
+    ### Static HTML of a saved dashboard for viewers who only look: no Dash renderer, no callbacks.
+    ### ?download=1 returns a self-contained file with plotly.js inlined.
+    if not DASHBOARD_NAME.match(name):
+        abort(404)
+    layout, layout_version = layout_store.load(name)
+    if not layout and not layout_version:
+        abort(404)
+    dashboard_access.record(name)
+
+    download = 'download' in request.args
+    key = snapshot_key(name, layout_version, layout, data_dict)
+    etag = f"{key}{'-download' if download else ''}"
+    if any(request.if_none_match.contains(tag) for tag in (etag, f'{etag}:br', f'{etag}:gzip')):
+        response = Response(status=304)
+    else:
+        body = snapshots.get(name, key, lambda: render_snapshot(layout, data_dict))
+        response = Response(snapshot_page(name, body, plotly_script(download)), mimetype='text/html')
+        if download:
+            response.headers['Content-Disposition'] = f'attachment; filename="{name}-v{layout_version}.html"'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+###############################################################################################################
+############################################### Data refresh ##################################################
+###############################################################################################################
+
+def refresh_datasets():
+    ### Picks up changed files in data/ (or tables), returns the datasets that changed
+    changed = data_dict.scan()
+    for dataset in changed:
+        figure_cache.invalidate(dataset)
+    return changed
+
+@app.callback(
+    Output('data-versions', 'data'),
+    [Input('data-poll', 'n_intervals')],
+    [State('data-store', 'data'), State('data-versions', 'data')]
+)
+def poll_data_versions(n_intervals, current_stored_data, current_versions):
+    ### Versions of the datasets the dashboard's graphs read, the clientside refreshGraphData
+    ### refetches the graphs whose dataset changed
+    if refresh_datasets():
+        prewarmer.trigger()
+
+    if not isinstance(current_stored_data, dict):
+        return dash.no_update
+    all_versions = data_dict.versions()
+    versions = {data['df']: all_versions[data['df']] for data in current_stored_data.values() if data['df'] in all_versions}
+    if versions == current_versions:
+        return dash.no_update
+    return versions
+
+app.clientside_callback(
+    ClientsideFunction(
+        namespace='clientside',
+        function_name='refreshGraphData'
+    ),
+    Output('data-refresh', 'data'),
+    Input('data-versions', 'data'),
     State('data-store', 'data')
 )
 
 ###############################################################################################################
-############################################### Update Body ###################################################
+################################################# Prewarming ##################################################
 ###############################################################################################################
 
+### Element failures already reported by prewarm_dashboard, as (dashboard, element id, error)
+prewarm_failures = set()
+
+def prewarm_dashboard(name):
+    ### What opening the dashboard needs: the elements createBody builds and the arrays each graph fetches.
+    ### A bad element is skipped, the rest of the dashboard is still warmed and it is reported only once.
+    stored_layout, _ = layout_store.load(name)
+    errors = []
+    createBody(stored_layout, element_key, data_dict, errors=errors)
+    failed = {element.id for element, _ in errors}
+    for element in stored_layout:
+        if not element.graph or element.id in failed:
+            continue
+        try:
+            cached_payload(element.data, data_dict, graph_representation(element.data, data_dict))
+        except Exception as error:
+            errors.append((element, error))
+
+    for element, error in errors:
+        failure = (name, element.id, repr(error))
+        if failure not in prewarm_failures:
+            prewarm_failures.add(failure)
+            print(f'Prewarming {name}: could not build {element.id}: {error!r}', file=sys.stderr)
+
+prewarmer = PrewarmScheduler(
+    prewarm_dashboard,
+    dashboard_access,
+    changed=refresh_datasets,
+    interval=PREWARM_INTERVAL,
+    max_workers=PREWARM_WORKERS,
+    limit=PREWARM_DASHBOARDS,
+    always=(DEFAULT_DASHBOARD,)
+)
+metrics.add_counter('prewarm_runs_total', 'Background cache warming runs', lambda: prewarmer.runs)
+metrics.add_counter('prewarm_dashboards_total', 'Dashboards warmed in the background', lambda: prewarmer.warmed)
+
+
 
 
 if __name__ == '__main__':
+    prewarmer.start()
     app.run_server(debug=True)
\ No newline at end of file
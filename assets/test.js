@@ -1,52 +1,315 @@
 window.dash_clientside = Object.assign({}, window.dash_clientside, {
     clientside: {
-        saveLayoutTest: function(saveButClicks, appBody, dataStore) {
-            let elements = []
+        updateBody: function(bodyUpdate, deleteClicks, body, dataStore) {
+            let triggered = dash_clientside.callback_context.triggered
+            let currentBody = body || []
+
+            for (i = 0; i < triggered.length; i++) {
+                let propId = triggered[i]['prop_id']
+
+                if (propId === 'body-update.data' && bodyUpdate) {
+                    if (bodyUpdate['action'] === 'load') {
+                        savedElements = rememberElements(bodyUpdate['children'].map(component => describeElement(component, dataStore, false)))
+                        pendingSaves = {}
+                        return bodyUpdate['children']
+                    } else if (bodyUpdate['action'] === 'add') {
+                        return currentBody.concat(bodyUpdate['children'])
+                    }
+                } else if (propId.startsWith('{') && triggered[i]['value']) {
+                    let trigger = JSON.parse(propId.slice(0, propId.lastIndexOf('.')))
+                    if (trigger['action'] === 'delete') {
+                        return currentBody.filter(element => element['props']['id'] !== trigger['input_id'])
+                    }
+                }
+            }
+
+            return dash_clientside.no_update
+        },
+        updatePlotText: function(modalData, textInputs, modalPlot) {
+            // Title edits only patch the preview's layout in the browser, the traces come from
+            // update_plot on the server and only change with the dataset / x / y / aggregate
+            let figure = modalPlot || {}
+            let layout = Object.assign({}, figure['layout'])
+            let [title, xTitle, yTitle] = textInputs
+
+            layout['title'] = {'text': title}
+            layout['xaxis'] = Object.assign({}, layout['xaxis'], {'title': {'text': xTitle}})
+            layout['yaxis'] = Object.assign({}, layout['yaxis'], {'title': {'text': yTitle}})
+
+            return {
+                'data': (modalData !== undefined && modalData !== null) ? modalData : (figure['data'] || []),
+                'layout': layout
+            }
+        },
+        refreshGraphData: function(versions, dataStore) {
+            // Only graphs whose dataset version moved past the v in their data-src are refetched.
+            // draw stays as it is, the server keeps sending arrays for the trace data-figure holds.
+            if (!versions || !dataStore) {
+                return dash_clientside.no_update
+            }
+
+            let refreshed = []
+            document.querySelectorAll('#body > [data-src]').forEach(element => {
+                let data = dataStore[element.id]
+                if (!data || !(data['df'] in versions)) {
+                    return
+                }
+                let url = new URL(element.dataset.src, window.location.origin)
+                if (url.searchParams.get('v') !== versions[data['df']]) {
+                    url.searchParams.set('v', versions[data['df']])
+                    element.dataset.src = url.pathname + url.search
+                    loadGraphData(element)
+                    refreshed.push(element.id)
+                }
+            })
+            return refreshed.length ? refreshed : dash_clientside.no_update
+        },
+        saveLayoutTest: function(saveButClicks, appBody, dataStore, saveAck) {
             if (!saveButClicks) {
                 return ""
-            } else {
-                for (i = 0; i < appBody.length; i++) {
-                    let id = appBody[i]['props']['id']
-
-                    let curr_child_py = appBody[i]
-                    let curr_child_js = $(`#${id}`)
-                    
-                    let element = {
-                        'id': `test-graph${i}`,
-                        'top': `${curr_child_js[0]['offsetTop'] / window.innerHeight * 100}%`,
-                        'left': `${curr_child_js[0]['offsetLeft'] / window.innerWidth * 100}%`,
-                        'height': `${curr_child_js[0]['clientHeight'] / window.innerHeight * 100}%`,
-                        'width': `${curr_child_js[0]['clientWidth'] / window.innerWidth * 100}%`,
-                        'type': `${curr_child_js[0]['localName']}`,
-                        'text': curr_child_js[0].classList.contains('graph') ? '' : curr_child_js[0]['innerText'],
-                        'graph': curr_child_js[0].classList.contains('graph'),
-                        'layout': curr_child_js[0].classList.contains('graph') ? curr_child_py['props']['children'][1]['props']['figure']['layout'] : '',
-                        'data': curr_child_js[0].classList.contains('graph') ? dataStore[id] : ""
-                    }
+            }
 
-                    elements.push(element)
+            // A save only becomes the baseline once update_body acknowledges it in save-ack.
+            // Edits of a save that failed are still different from the baseline, so the next
+            // diff sends them again.
+            if (saveAck && saveAck['save'] in pendingSaves) {
+                savedElements = pendingSaves[saveAck['save']]
+                for (const saveId of Object.keys(pendingSaves)) {
+                    if (Number(saveId) <= saveAck['save']) {
+                        delete pendingSaves[saveId]
+                    }
                 }
+            }
+
+            let elements = appBody.map(component => describeElement(component, dataStore, true))
+            let previous = savedElements
+            let saveId = ++saveCount
+            let current = rememberElements(elements)
+            pendingSaves[saveId] = current
 
-                return elements
+            if (!previous) {
+                return {'layout': elements, 'save': saveId}
             }
+
+            // Only elements whose position, size, text or data spec changed are sent
+            let diff = {
+                'changed': elements.filter(element => !sameElement(element, previous['elements'][element['id']])),
+                'removed': previous['order'].filter(id => !(id in current['elements'])),
+                'save': saveId
+            }
+            if (current['order'].join() !== previous['order'].join()) {
+                diff['order'] = current['order']
+            }
+            if (!diff['changed'].length && !diff['removed'].length && !diff['order']) {
+                delete pendingSaves[saveId]
+                return dash_clientside.no_update
+            }
+            return diff
         }
     }
 })
 
 
+// Elements as last saved (or loaded), saveLayoutTest diffs against these. pendingSaves holds
+// the elements of each save not acknowledged yet, by the save number sent with it.
+let savedElements = null
+let pendingSaves = {}
+let saveCount = 0
+const geometryKeys = ['top', 'left', 'height', 'width']
+
+function percentOf(node, prop, pixels, total) {
+    let value = node.style[prop]
+    return value && value.endsWith('%') ? value : `${pixels / total * 100}%`
+}
+
+function describeElement(component, dataStore, fromDom) {
+    let id = component['props']['id']
+    let node = fromDom ? document.getElementById(id) : null
+    let style = component['props']['style'] || {}
+    let classes = node ? Array.from(node.classList) : (component['props']['className'] || '').split(' ')
+    let graph = classes.includes('graph')
+
+    // Error boxes stand for an element the server could not render, it keeps that element as stored
+    if (classes.includes('invalid')) {
+        return {'id': id, 'invalid': true}
+    }
+
+    return {
+        'id': id,
+        'top': node ? percentOf(node, 'top', node['offsetTop'], window.innerHeight) : style['top'],
+        'left': node ? percentOf(node, 'left', node['offsetLeft'], window.innerWidth) : style['left'],
+        'height': node ? percentOf(node, 'height', node['clientHeight'], window.innerHeight) : style['height'],
+        'width': node ? percentOf(node, 'width', node['clientWidth'], window.innerWidth) : style['width'],
+        'type': node ? node['localName'] : component['type'].toLowerCase(),
+        'text': graph ? '' : (node ? node['innerText'] : component['props']['children']),
+        'graph': graph,
+        'layout': graph ? JSON.parse(component['props']['data-figure'])['layout'] : '',
+        'data': graph ? dataStore[id] : ""
+    }
+}
+
+function stableStringify(value) {
+    if (Array.isArray(value)) {
+        return `[${value.map(stableStringify).join()}]`
+    } else if (value && typeof value === 'object') {
+        return `{${Object.keys(value).sort().map(key => `${JSON.stringify(key)}:${stableStringify(value[key])}`).join()}}`
+    }
+    return JSON.stringify(value)
+}
+
+function rememberElements(elements) {
+    let remembered = {'elements': {}, 'order': []}
+    for (const element of elements) {
+        remembered['elements'][element['id']] = JSON.parse(JSON.stringify(element))
+        remembered['order'].push(element['id'])
+    }
+    return remembered
+}
+
+function sameElement(element, previous) {
+    if (!previous) {
+        return false
+    }
+    for (const key of Object.keys(element)) {
+        if (geometryKeys.includes(key)) {
+            // The browser may re-serialise percentages with less precision than they were saved with
+            if (!(Math.abs(parseFloat(element[key]) - parseFloat(previous[key])) < 0.01)) {
+                return false
+            }
+        } else if (stableStringify(element[key]) !== stableStringify(previous[key])) {
+            return false
+        }
+    }
+    return true
+}
+
+
+// Chart arrays are fetched from each graph's data-src (see createGraph / serve_chart_data).
+// Numeric arrays arrive as base64 buffers and are decoded into typed arrays.
+const typedArrays = {'f8': Float64Array, 'f4': Float32Array, 'i4': Int32Array, 'u1': Uint8Array}
+
+function decodeArray(encoded) {
+    if (!encoded || Array.isArray(encoded)) {
+        return encoded
+    }
+    let bytes = Uint8Array.from(atob(encoded['bdata']), c => c.charCodeAt(0))
+    return new typedArrays[encoded['dtype']](bytes.buffer)
+}
+
+// Graphs are drawn lazily: createGraph only renders a placeholder sized like the element, the
+// figure is drawn the first time the element comes near the viewport, or again once its
+// data-src changes while it is in view
+const visibleElements = new Set()
+const graphObserver = ('IntersectionObserver' in window) ? new IntersectionObserver(entries => {
+    for (const entry of entries) {
+        if (entry.isIntersecting) {
+            visibleElements.add(entry.target)
+            loadGraphData(entry.target)
+        } else {
+            visibleElements.delete(entry.target)
+        }
+    }
+}, {rootMargin: '200px'}) : null
+
+// The default plotly template, sent once on #body instead of in every graph's data-figure
+let plotlyTemplate = null
+
+function withTemplate(layout) {
+    if ('template' in layout) {
+        return layout
+    }
+    if (plotlyTemplate === null) {
+        let body = document.getElementById('body')
+        plotlyTemplate = JSON.parse((body && body.dataset.template) || '{}')
+    }
+    return Object.assign({'template': plotlyTemplate}, layout)
+}
+
+function loadGraphData(element, attempt = 0) {
+    let src = element.dataset.src
+    let placeholder = element.querySelector('.graph-placeholder')
+
+    if (!src || !placeholder || element.dataset.loaded === src) {
+        return
+    }
+    if (graphObserver && !visibleElements.has(element)) {
+        return
+    }
+    if (!window.Plotly) {
+        if (attempt < 50) {
+            setTimeout(() => loadGraphData(element, attempt + 1), 100)
+        }
+        return
+    }
+
+    element.dataset.loaded = src
+    let figure = JSON.parse(element.dataset.figure || '{}')
+    fetch(src)
+        .then(response => response.json())
+        .then(payload => {
+            let traces = (figure['data'] || [{}]).map(trace => Object.assign({}, trace))
+            for (const [attr, encoded] of Object.entries(payload)) {
+                traces[0][attr] = decodeArray(encoded)
+            }
+            Plotly.react(placeholder, traces, withTemplate(figure['layout'] || {}), {'responsive': true})
+        })
+        .catch(() => { delete element.dataset.loaded })
+}
+
+function observeGraphs() {
+    document.querySelectorAll('#body > [data-src]').forEach(element => {
+        if (graphObserver) {
+            graphObserver.observe(element)
+        } else {
+            loadGraphData(element)
+        }
+    })
+}
+
+function forgetElements(nodes) {
+    for (const node of nodes) {
+        if (graphObserver && node.nodeType === Node.ELEMENT_NODE) {
+            graphObserver.unobserve(node)
+            visibleElements.delete(node)
+        }
+    }
+}
+
+function setupElements() {
+    // Draggable / resizable for elements not set up yet; positions and sizes are kept in %
+    $('.draggable').not('.ui-draggable').draggable({
+        stop: function() {
+            $(this).css('left', `${this['offsetLeft'] / window.innerWidth * 100}%`)
+            $(this).css('top', `${this['offsetTop'] / window.innerHeight * 100}%`)
+        }
+    })
+    $('.draggable').not('.ui-resizable').resizable({
+        stop: function() {
+            $(this).width(`${this['clientWidth'] / window.innerWidth * 100}%`)
+            $(this).height(`${this['clientHeight'] / window.innerHeight * 100}%`)
+            let graphDiv = this.querySelector('.js-plotly-plot')
+            if (graphDiv) {
+                Plotly.Plots.resize(graphDiv)
+            }
+        }
+    })
+    $('.draggable').addClass('absolute')
+    observeGraphs()
+}
+
+
 window.onload = (event) => {
     console.log('page is fully loaded');
 
     setTimeout(function(){
 
-        // setting up draggable / resizable for new elements added 
+        // setting up draggable / resizable / lazy drawing for elements added later
         const config = {attributes: false, childList: true, subtree: false};
         const draggableCallback= function(mutationList, observer) {
             for (const mutation of mutationList){
                 if (mutation.type === 'childList') {
-                    $(".draggable").draggable();
-                    $(".draggable").resizable();
-                    $(".draggable").addClass('absolute');
+                    forgetElements(mutation.removedNodes)
+                    setupElements();
                 }
             }
 
@@ -55,22 +318,8 @@ window.onload = (event) => {
         const observer = new MutationObserver(draggableCallback)
         observer.observe(document.getElementById('body'), config)
 
-        // draggable and resizable for existing elements
-        $(".draggable").draggable();
-        $(".draggable").resizable();
-        $(".draggable").addClass('absolute');
-
-        $('.ui-resizable-handle').mouseup(function() {
-            let parent = $(this).parent()
-
-            parent.width(`${parent[0]['clientWidth'] / window.innerWidth * 100}%`)
-            parent.height(`${parent[0]['clientHeight'] / window.innerHeight * 100}%`)
-        })
-
-        $('.draggable').mouseup(function() {
-            $(this).css('left', `${$(this)[0]['offsetLeft'] / window.innerWidth * 100}%`)
-            $(this).css('top',`${$(this)[0]['offsetTop'] / window.innerHeight * 100}%`)
-        })
+        // and for the elements already there
+        setupElements();
 
     }, 1000);
-};
\ No newline at end of file
+};
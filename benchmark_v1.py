@@ -0,0 +1,428 @@
+### Performance harness for app_v4: builds synthetic datasets and saved layouts, times the
+### layout functions and the server callbacks, and writes the results as JSON.
+###
+###     python benchmark_v1.py                                  # default sizes
+###     python benchmark_v1.py --rows 1000 10000000 --elements 1 500
+###     python benchmark_v1.py --rows 1000000 --elements 1 --workers 1 4 8   # memory per gunicorn worker
+###     python benchmark_v1.py --compare cache/benchmark/old.json cache/benchmark/new.json
+###
+### Callbacks are called through Flask's test client with the same JSON the browser posts,
+### so response sizes are what would go over the wire. Deleting an element is handled by the
+### clientside updateBody and sends no request, so there is no server-side delete to time.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import subprocess
+import tracemalloc
+import numpy as np
+import pandas as pd
+from plotly.utils import PlotlyJSONEncoder
+
+import app_v4
+from data_functions_v1 import DataRegistry
+from figure_functions_v1 import figure_cache, data_url
+from store_functions_v1 import FileLayoutStore
+from layout_functions_v1 import createBody, createElement, createGraph, createDataStore
+from element_functions_v1 import parse_layout, layout_record
+from chart_functions_v1 import CHARTS
+
+DEFAULT_ROWS = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6]
+DEFAULT_ELEMENTS = [1, 10, 100, 500]
+DEFAULT_WORKDIR = 'cache/benchmark'
+
+# Link speed used to estimate time to first render from server time plus transfer size
+TRANSFER_MBIT = 10
+
+# A result is reported as a regression by --compare when it is this much slower / bigger
+REGRESSION_RATIO = 1.2
+
+###############################################################################################################
+#                                               Synthetic data                                                #
+###############################################################################################################
+
+def make_dataset(path, rows, seed=0):
+    if os.path.exists(path):
+        return path
+    rng = np.random.default_rng(seed)
+    chunk_rows = 10 ** 6
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        pd.DataFrame({
+            'category': rng.choice([f'category-{i}' for i in range(50)], n),
+            'day': rng.integers(0, 3650, n),
+            'value': rng.normal(100, 25, n).round(3),
+            'units': rng.integers(0, 100, n)
+        }).to_csv(path, mode='a' if start else 'w', header=not start, index=False)
+    return path
+
+def make_element(i, dataset):
+    ### In the format the browser posts (schema 1), parse_layout turns it into an Element
+    geometry = {'top': f'{i % 10 * 9}%', 'left': f'{i // 10 % 10 * 9}%', 'height': '8%', 'width': '8%'}
+    kind = i % 3
+    if kind == 0:
+        return dict(geometry, id=f'bench-{i}', type='h1', text=f'Title {i}', graph=False, layout='', data='')
+    elif kind == 1:
+        return dict(geometry, id=f'bench-{i}', type='p', text=f'Paragraph {i}', graph=False, layout='', data='')
+    else:
+        x = 'category' if i % 2 else 'day'
+        return dict(
+            geometry, id=f'bench-{i}', type='div', text='', graph=True,
+            layout={'title': {'text': f'Chart {i}'}, 'xaxis': {'title': {'text': x}}, 'yaxis': {'title': {'text': 'value'}}},
+            data={'df': dataset, 'x': x, 'y': 'value', 'agg': ['sum', 'mean', 'count'][i % 3], 'marker_color': 'purple'}
+        )
+
+def make_layout(n, dataset):
+    return [make_element(i, dataset) for i in range(n)]
+
+###############################################################################################################
+#                                                 Measuring                                                   #
+###############################################################################################################
+
+def response_size(result):
+    if hasattr(result, 'data'):
+        return len(result.data)
+    if isinstance(result, list) and result and all(hasattr(element, 'to_dict') for element in result):
+        ### Parsed layouts are reported at their stored size
+        result = layout_record(result)
+    return len(json.dumps(result, cls=PlotlyJSONEncoder))
+
+def measure(fn, repeat=3, setup=None):
+    ### Wall time is the median of repeat untraced runs, peak memory comes from one extra
+    ### run under tracemalloc (which slows it down too much to time)
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    try:
+        result = fn()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'wall_ms': statistics.median(times) * 1000,
+        'min_ms': min(times) * 1000,
+        'peak_kb': peak / 1024,
+        'bytes': response_size(result)
+    }
+
+def callback_key(app, output):
+    return next(key for key in app.callback_map if output in key)
+
+def dash_request(app, output, outputs, inputs, state, changed, headers=None):
+    payload = {
+        'output': callback_key(app, output),
+        'outputs': outputs,
+        'inputs': inputs,
+        'state': state,
+        'changedPropIds': changed
+    }
+    response = app.server.test_client().post('/_dash-update-component', json=payload, headers=headers)
+    if response.status_code not in (200, 204):
+        raise RuntimeError(f'{output} returned {response.status_code}: {response.data[:500]}')
+    return response
+
+def prop(id, property, value=None):
+    return {'id': id, 'property': property, 'value': value}
+
+###############################################################################################################
+#                                                Benchmarks                                                   #
+###############################################################################################################
+
+def update_body_request(app, trigger, memory='', add_clicks=0, data_store=None, add_inputs=None, headers=None):
+    plot = 'bar-chart'
+    dataset, x, y = add_inputs or (None, None, None)
+    return dash_request(
+        app, 'body-update.data',
+        outputs=[{'id': 'body-update', 'property': 'data'}, {'id': 'data-store', 'property': 'data'}, {'id': 'save-ack', 'property': 'data'}],
+        inputs=[prop('memory', 'data', memory), prop('add-button', 'n_clicks', add_clicks)],
+        state=[
+            prop('url', 'search', '?dashboard=benchmark'),
+            prop('data-store', 'data', data_store if data_store is not None else {}),
+            prop('modal-type', 'data', plot),
+            [prop({'type': 'input-col', 'plot': plot, 'input_id': input_id, 'panel': 'text'}, 'value', input_id) for input_id in ('title', 'x-title', 'y-title')],
+            [prop({'type': 'input', 'plot': plot, 'input_id': 'data-dd', 'panel': 'data'}, 'value', dataset)],
+            [prop({'type': 'input-col', 'plot': plot, 'input_id': input_id, 'panel': 'data'}, 'value', value) for input_id, value in (('x-col-dd', x), ('y-col-dd', y))],
+            [prop({'type': 'input-agg', 'plot': plot, 'input_id': 'agg-dd', 'panel': 'data'}, 'value', 'sum')]
+        ],
+        changed=[trigger],
+        headers=headers
+    )
+
+def update_plot_request(app, dataset, x, y, agg='sum'):
+    plot = 'bar-chart'
+    return dash_request(
+        app, '"modal-data"}.data',
+        outputs={'id': {'type': 'modal-data', 'plot': plot}, 'property': 'data'},
+        inputs=[
+            [prop({'type': 'input-col', 'plot': plot, 'input_id': input_id, 'panel': 'data'}, 'value', value) for input_id, value in (('x-col-dd', x), ('y-col-dd', y))],
+            [prop({'type': 'input-agg', 'plot': plot, 'input_id': 'agg-dd', 'panel': 'data'}, 'value', agg)]
+        ],
+        state=[[prop({'type': 'input', 'plot': plot, 'input_id': 'data-dd', 'panel': 'data'}, 'value', dataset)]],
+        changed=[json.dumps({'input_id': 'y-col-dd', 'panel': 'data', 'plot': plot, 'type': 'input-col'}) + '.value']
+    )
+
+def update_column_selectors_request(app, dataset):
+    plot = 'bar-chart'
+    return dash_request(
+        app, '"input-col"}.options',
+        outputs=[
+            [{'id': {'type': 'input-col', 'plot': plot, 'input_id': input_id, 'panel': 'data'}, 'property': 'options'} for input_id in ('x-col-dd', 'y-col-dd')],
+            [{'id': {'type': 'input-col', 'plot': plot, 'input_id': input_id, 'panel': 'data'}, 'property': 'value'} for input_id in ('x-col-dd', 'y-col-dd')]
+        ],
+        inputs=[prop({'type': 'input', 'plot': plot, 'input_id': 'data-dd', 'panel': 'data'}, 'value', dataset)],
+        state=[],
+        changed=[json.dumps({'input_id': 'data-dd', 'panel': 'data', 'plot': plot, 'type': 'input'}) + '.value']
+    )
+
+def chart_data_url(chart_type, dataset):
+    ### x is the category column, unless the chart only plots numeric x (scatter, histogram)
+    chart = CHARTS[chart_type]
+    columns = {'x': 'day' if 'x' in chart.numeric else 'category', 'y': 'value', 'z': 'value'}
+    data_spec = dict({key: columns[key] for key in chart.columns}, df=dataset, chart=chart_type)
+    return data_url(data_spec, 'bench')
+
+def bench_datasets(app, cold, datasets, repeat, record):
+    for rows, dataset in datasets:
+        params = {'rows': rows}
+        record('update_column_selectors', dict(params, cache='cold'), measure(lambda: update_column_selectors_request(app, dataset), repeat, setup=cold))
+        record('update_column_selectors', dict(params, cache='warm'), measure(lambda: update_column_selectors_request(app, dataset), repeat))
+        for x in ('category', 'day'):
+            record('update_plot', dict(params, x=x, cache='cold'), measure(lambda: update_plot_request(app, dataset, x, 'value'), repeat, setup=cold))
+            record('update_plot', dict(params, x=x, cache='warm'), measure(lambda: update_plot_request(app, dataset, x, 'value'), repeat))
+            url = data_url({'df': dataset, 'x': x, 'y': 'value', 'agg': 'sum'}, 'bench')
+            record('serve_chart_data', dict(params, x=x, cache='cold'), measure(lambda: app.server.test_client().get(url), repeat, setup=cold))
+        for chart_type in CHARTS:
+            url = chart_data_url(chart_type, dataset)
+            record('serve_chart_data', dict(params, chart=chart_type, cache='cold'), measure(lambda: app.server.test_client().get(url), repeat, setup=cold))
+
+def bench_layouts(app, layout_store, dataset, element_counts, repeat, record):
+    element_key, data_dict = app_v4.element_key, app_v4.data_dict
+    graph = parse_layout([make_element(2, dataset)])[0]
+    record('createGraph', {}, measure(lambda: createGraph(graph, data_dict), repeat, setup=figure_cache.invalidate))
+    for element in parse_layout(make_layout(3, dataset)):
+        record('createElement', {'type': element.type}, measure(lambda: createElement(element, element_key, data_dict), repeat))
+
+    for n in element_counts:
+        posted = make_layout(n, dataset)
+        layout = parse_layout(posted)
+        params = {'elements': n}
+        stored = layout_record(layout)['layout']
+        record('parse_layout', dict(params, schema=1), measure(lambda: parse_layout(posted), repeat))
+        record('parse_layout', dict(params, schema=2), measure(lambda: parse_layout(stored, 2), repeat))
+        record('createDataStore', params, measure(lambda: createDataStore(layout), repeat))
+        for workers in (None, app_v4.RENDER_WORKERS):
+            record('createBody', dict(params, workers=workers or 1), measure(lambda: createBody(layout, element_key, data_dict, max_workers=workers), repeat, setup=figure_cache.invalidate))
+
+        layout_store.save('benchmark', layout)
+        data_store = createDataStore(layout)
+        record('update_body.load', dict(params, cache='cold'), measure(lambda: update_body_request(app, 'memory.data', memory=''), repeat, setup=figure_cache.invalidate))
+        record('update_body.load', dict(params, cache='warm'), measure(lambda: update_body_request(app, 'memory.data', memory=''), repeat))
+        record('update_body.save', dict(params, kind='full'), measure(lambda: update_body_request(app, 'memory.data', memory=posted), repeat))
+        diff = {'changed': [dict(posted[0], top='50%')], 'removed': [posted[-1]['id']] if n > 1 else []}
+        record('update_body.save', dict(params, kind='diff'), measure(lambda: update_body_request(app, 'memory.data', memory=diff), repeat))
+        record('update_body.add', params, measure(
+            lambda: update_body_request(app, 'add-button.n_clicks', memory=None, add_clicks=1, data_store=dict(data_store), add_inputs=(dataset, 'category', 'value')),
+            repeat
+        ))
+
+def load_dashboard(app, layout, encoding):
+    ### Everything a browser downloads to draw a saved dashboard: the index page and its
+    ### scripts / stylesheets, the update_body load response and each graph's data
+    client = app.server.test_client()
+    headers = {'Accept-Encoding': encoding}
+    index = client.get('/?dashboard=benchmark', headers={'Accept-Encoding': 'identity'}).data.decode()
+    urls = ['/?dashboard=benchmark'] + [url for url in re.findall(r'(?:src|href)="(/[^"]+)"', index)]
+    urls += [data_url(element.data, app_v4.data_dict.version(element.data['df'])) for element in layout if element.graph]
+
+    total = 0
+    for url in urls:
+        total += len(client.get(url, headers=headers).data)
+    response = update_body_request(app, 'memory.data', memory='', headers=headers)
+    return total + len(response.data)
+
+def bench_transfer(app, layout_store, dataset, element_counts, repeat, record):
+    for n in element_counts:
+        layout = parse_layout(make_layout(n, dataset))
+        layout_store.save('benchmark', layout)
+        for encoding in ('identity', 'gzip', 'br'):
+            sizes = []
+            measured = measure(lambda: sizes.append(load_dashboard(app, layout, encoding)), repeat)
+            measured['bytes'] = sizes[-1]
+            measured['est_first_render_ms'] = measured['wall_ms'] + sizes[-1] * 8 / (TRANSFER_MBIT * 10 ** 6) * 1000
+            record('dashboard_transfer', {'elements': n, 'encoding': encoding}, measured)
+
+def process_memory():
+    ### Linux only: resident / proportional / private memory of this process in KB.
+    ### PSS splits shared pages between the processes mapping them, so summing it over
+    ### the workers gives their real combined footprint.
+    memory = {}
+    with open('/proc/self/smaps_rollup', 'r') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('Rss', 'Pss', 'Private_Clean', 'Private_Dirty'):
+                memory[key] = int(value.split()[0])
+    return {'rss_kb': memory['Rss'], 'pss_kb': memory['Pss'], 'private_kb': memory['Private_Clean'] + memory['Private_Dirty']}
+
+def worker_load(data_dir, cache_dir, datasets, loaded, done, results):
+    ### One forked "worker": load every dataset and aggregate it, then report its memory once
+    ### all workers hold their data
+    start = time.perf_counter()
+    before = process_memory()
+    registry = DataRegistry(data_dir, cache_dir=cache_dir)
+    for _, dataset in datasets:
+        registry[dataset]
+        registry.aggregate(dataset, 'category', 'value')
+    elapsed = time.perf_counter() - start
+    loaded.wait()
+    after = process_memory()
+    results.put({'wall_ms': elapsed * 1000, **{key: after[key] - before[key] for key in after}})
+    done.wait()
+
+def bench_worker_memory(data_dir, cache_dir, datasets, worker_counts, record):
+    ### What N gunicorn workers cost: "private" parses the CSVs in every worker, "shared" is
+    ### the preload_app setup from gunicorn.conf.py / wsgi.py, where the columnar cache is
+    ### prewarmed before forking and every worker memory-maps the same files
+    import multiprocessing
+    context = multiprocessing.get_context('fork')
+    DataRegistry(data_dir, cache_dir=cache_dir).prewarm()
+    rows = sum(n for n, _ in datasets)
+
+    for workers in worker_counts:
+        for mode, mode_cache_dir in (('private', None), ('shared', cache_dir)):
+            loaded, done, results = context.Barrier(workers + 1), context.Barrier(workers + 1), context.Queue()
+            processes = [context.Process(target=worker_load, args=(data_dir, mode_cache_dir, datasets, loaded, done, results)) for _ in range(workers)]
+            for process in processes:
+                process.start()
+            loaded.wait()
+            measured = [results.get() for _ in processes]
+            done.wait()
+            for process in processes:
+                process.join()
+
+            record('worker_memory', {'workers': workers, 'mode': mode, 'rows': rows}, {
+                'wall_ms': max(worker['wall_ms'] for worker in measured),
+                'peak_kb': statistics.mean(worker['pss_kb'] for worker in measured),
+                'bytes': 0,
+                'total_pss_kb': sum(worker['pss_kb'] for worker in measured),
+                'rss_kb': statistics.mean(worker['rss_kb'] for worker in measured),
+                'private_kb': statistics.mean(worker['private_kb'] for worker in measured)
+            })
+
+###############################################################################################################
+#                                                  Reports                                                    #
+###############################################################################################################
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def result_key(result):
+    return (result['name'], json.dumps(result['params'], sort_keys=True))
+
+def compare(old_path, new_path, ratio=REGRESSION_RATIO):
+    with open(old_path, 'r') as f:
+        old = {result_key(result): result for result in json.load(f)['results']}
+    with open(new_path, 'r') as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'benchmark':<72} {'old ms':>10} {'new ms':>10} {'ratio':>7} {'old KB':>10} {'new KB':>10}")
+    for result in new:
+        before = old.get(result_key(result))
+        if before is None:
+            continue
+        time_ratio = result['wall_ms'] / max(before['wall_ms'], 1e-6)
+        size_ratio = result['bytes'] / max(before['bytes'], 1)
+        flag = ''
+        if time_ratio > ratio or size_ratio > ratio:
+            flag = '  REGRESSION'
+            regressions += 1
+        name = f"{result['name']} {result_key(result)[1]}"
+        print(f"{name:<72} {before['wall_ms']:>10.2f} {result['wall_ms']:>10.2f} {time_ratio:>7.2f} {before['bytes'] / 1024:>10.1f} {result['bytes'] / 1024:>10.1f}{flag}")
+    return regressions
+
+def run(rows, element_counts, workdir, output, repeat, worker_counts=()):
+    data_dir, layout_dir = os.path.join(workdir, 'data'), os.path.join(workdir, 'layouts')
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(layout_dir, exist_ok=True)
+
+    datasets = []
+    for n in rows:
+        print(f'Generating {n:,} rows', file=sys.stderr)
+        make_dataset(os.path.join(data_dir, f'synthetic-{n}.csv'), n)
+        datasets.append((n, f'synthetic-{n}.csv'))
+
+    ### Point the app's module globals at the synthetic data, the callbacks read them at call time.
+    ### "cold" is a freshly started process: nothing parsed in memory, the on-disk columnar cache kept.
+    def cold():
+        app_v4.data_dict = DataRegistry(data_dir, memory_budget=app_v4.DATA_MEMORY_BUDGET, cache_dir=os.path.join(workdir, 'cache'))
+        figure_cache.invalidate()
+
+    cold()
+    layout_store = FileLayoutStore(layout_dir)
+    app_v4.layout_store = layout_store
+    app = app_v4.app
+
+    results = []
+    def record(name, params, measured):
+        results.append(dict(name=name, params=params, **measured))
+        print(f"{name:<28} {json.dumps(params):<50} {measured['wall_ms']:>10.2f} ms {measured['peak_kb']:>10.0f} KB peak {measured['bytes']:>10} B", file=sys.stderr)
+
+    bench_datasets(app, cold, datasets, repeat, record)
+    bench_layouts(app, layout_store, datasets[0][1], element_counts, repeat, record)
+    bench_transfer(app, layout_store, datasets[0][1], element_counts, repeat, record)
+    if worker_counts:
+        bench_worker_memory(data_dir, os.path.join(workdir, 'cache'), datasets, worker_counts, record)
+
+    report = {
+        'meta': {
+            'revision': git_revision(),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'rows': rows,
+            'elements': element_counts,
+            'repeat': repeat,
+            'workers': list(worker_counts)
+        },
+        'results': results
+    }
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Wrote {output}', file=sys.stderr)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark dashboard load, chart creation and save paths')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--elements', type=int, nargs='+', default=DEFAULT_ELEMENTS)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--workdir', default=DEFAULT_WORKDIR)
+    parser.add_argument('--output', default=None)
+    parser.add_argument('--workers', type=int, nargs='*', default=[], help='Also measure memory per forked worker for these worker counts')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare) else 0)
+
+    output = args.output or os.path.join(args.workdir, f"results-{git_revision() or time.strftime('%Y%m%d-%H%M%S')}.json")
+    run(args.rows, args.elements, args.workdir, output, args.repeat, args.workers)
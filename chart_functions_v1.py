@@ -0,0 +1,226 @@
+import numpy as np
+import plotly.graph_objects as go
+from data_functions_v1 import AGGREGATIONS, MAX_POINTS, MAX_CATEGORIES, column_info
+
+# Data specs saved before there were chart types are bar charts
+DEFAULT_CHART = 'bar-chart'
+
+# Slices of a pie chart, the largest groups are kept
+PIE_SLICES = 25
+
+# Bins of a histogram, counted on the server
+HISTOGRAM_BINS = 50
+
+# How a trace is drawn, by its number of points, see PointBudget
+SVG = 'svg'
+WEBGL = 'webgl'
+BINNED = 'binned'
+
+
+class PointBudget:
+    # How many points a single trace may send to the browser. Up to svg points it is drawn
+    # with SVG, up to webgl points with a WebGL trace type (SVG slows down past a few thousand
+    # points); beyond that the chart is drawn from bins counted on the server, for scatter
+    # plots a density grid of density_bins x density_bins cells. app_v4 sets the budget.
+
+    def __init__(self, svg=5000, webgl=100000, density_bins=200):
+        self.configure(svg, webgl, density_bins)
+
+    def configure(self, svg, webgl, density_bins=200):
+        if not 0 < svg <= webgl:
+            raise ValueError(f'Point budget needs 0 < svg <= webgl, got {svg!r} and {webgl!r}')
+        self.svg = svg
+        self.webgl = webgl
+        self.density_bins = density_bins
+
+    def representation(self, points):
+        if points <= self.svg:
+            return SVG
+        elif points <= self.webgl:
+            return WEBGL
+        return BINNED
+
+    def key(self):
+        # Changes whenever a figure built under this budget could look different
+        return [self.svg, self.webgl, self.density_bins]
+
+
+point_budget = PointBudget()
+
+
+class Chart:
+    # A chart type for graph elements. columns are the data spec keys that name a dataset
+    # column (x, y, ...), numeric the ones only numeric columns are offered for, and
+    # aggregations what the Aggregate select offers (empty for charts that plot rows as
+    # they are). max_groups is how many x values are kept before the chart gets reduced
+    # (None when it never is). trace() is the styled trace without data, arrays() the trace attributes
+    # filled from the dataset, already aggregated, binned or sampled down on the server. Both
+    # are given the representation point_budget picked for points(), the trace's size.
+
+    label = None
+    columns = ('x', 'y')
+    column_labels = {}
+    numeric = ('y',)
+    aggregations = AGGREGATIONS
+    max_groups = MAX_POINTS
+
+    def points(self, data_spec, data_dict):
+        # Estimated from the dataset's metadata, without reading the data
+        cardinality = column_info(data_dict.metadata(data_spec['df']), data_spec['x'])['cardinality']
+        return cardinality if self.max_groups is None else min(cardinality, self.max_groups)
+
+    def trace(self, data_spec, representation):
+        raise NotImplementedError
+
+    def arrays(self, data_spec, data_dict, representation):
+        x, y = data_dict.aggregate(data_spec['df'], data_spec['x'], data_spec['y'], how=data_spec.get('agg', 'sum'))
+        return {'x': x, 'y': y}
+
+    def column_label(self, key):
+        return self.column_labels.get(key, key.upper())
+
+    def data_key(self, data_spec):
+        # The part of a data spec that decides the arrays (not colours or titles)
+        key = {'chart': chart_name(data_spec), 'df': data_spec['df']}
+        key.update((column, data_spec[column]) for column in self.columns)
+        if self.aggregations:
+            key['agg'] = data_spec.get('agg', self.aggregations[0])
+        return key
+
+    def check(self, data_spec):
+        for key in ('df',) + self.columns:
+            if not isinstance(data_spec.get(key), str) or not data_spec[key]:
+                raise ValueError(f'Graph data has no {key!r}')
+        if self.aggregations and data_spec.get('agg', self.aggregations[0]) not in self.aggregations:
+            raise ValueError(f"Unknown aggregation {data_spec['agg']!r}")
+
+
+class BarChart(Chart):
+    # plotly has no WebGL bars, bar charts stay within the budget by keeping max_groups bars
+    label = 'Bar chart'
+
+    def trace(self, data_spec, representation):
+        return go.Bar(marker_color=data_spec.get('marker_color'))
+
+
+class LineChart(Chart):
+    # One point per x value, up to the point budget: SVG lines keep point_budget.svg points,
+    # longer ones are drawn with WebGL and keep point_budget.webgl. Past that, numeric x is
+    # downsampled with LTTB by aggregate, which keeps the line's shape.
+    label = 'Line chart'
+
+    @property
+    def max_groups(self):
+        return point_budget.webgl
+
+    def trace(self, data_spec, representation):
+        trace_type = go.Scatter if representation == SVG else go.Scattergl
+        return trace_type(mode='lines', line_color=data_spec.get('marker_color'))
+
+    def arrays(self, data_spec, data_dict, representation):
+        max_points = point_budget.svg if representation == SVG else point_budget.webgl
+        x, y = data_dict.aggregate(data_spec['df'], data_spec['x'], data_spec['y'], how=data_spec.get('agg', 'sum'), max_points=max_points)
+        return {'x': x, 'y': y}
+
+
+class PieChart(Chart):
+    label = 'Pie chart'
+    column_labels = {'x': 'Labels', 'y': 'Values'}
+    max_groups = PIE_SLICES
+
+    def trace(self, data_spec, representation):
+        return go.Pie(sort=False)
+
+    def arrays(self, data_spec, data_dict, representation):
+        labels, values = data_dict.aggregate(data_spec['df'], data_spec['x'], data_spec['y'], how=data_spec.get('agg', 'sum'), max_points=PIE_SLICES)
+        return {'labels': labels, 'values': values}
+
+
+class ScatterChart(Chart):
+    # One marker per row, no aggregation. Past the WebGL budget the rows are counted into a
+    # density grid on the server (a histogram2d drawn as a heatmap), empty cells left blank.
+    label = 'Scatter plot'
+    numeric = ('x', 'y')
+    aggregations = ()
+    max_groups = None
+
+    def points(self, data_spec, data_dict):
+        return data_dict.metadata(data_spec['df'])['rows']
+
+    def trace(self, data_spec, representation):
+        if representation == BINNED:
+            return go.Heatmap(colorscale='Viridis', colorbar_title_text='Rows', hoverongaps=False)
+        trace_type = go.Scatter if representation == SVG else go.Scattergl
+        return trace_type(mode='markers', marker_color=data_spec.get('marker_color'))
+
+    def arrays(self, data_spec, data_dict, representation):
+        x, y = data_spec['x'], data_spec['y']
+        if representation == BINNED:
+            x_edges, y_edges, counts = data_dict.histogram2d(data_spec['df'], x, y, point_budget.density_bins)
+            return {
+                'x': (x_edges[:-1] + x_edges[1:]) / 2,
+                'y': (y_edges[:-1] + y_edges[1:]) / 2,
+                'z': np.where(counts > 0, counts, np.nan)
+            }
+        rows = data_dict.sample(data_spec['df'], [x, y], point_budget.webgl)
+        return {'x': rows.iloc[:, 0].to_numpy(), 'y': rows.iloc[:, 1].to_numpy()}
+
+
+class HistogramChart(Chart):
+    # Binned on the server, the browser only gets one bar per bin
+    label = 'Histogram'
+    columns = ('x',)
+    numeric = ('x',)
+    aggregations = ()
+    max_groups = None
+
+    def points(self, data_spec, data_dict):
+        return HISTOGRAM_BINS
+
+    def trace(self, data_spec, representation):
+        return go.Bar(marker_color=data_spec.get('marker_color'))
+
+    def arrays(self, data_spec, data_dict, representation):
+        edges, counts = data_dict.histogram(data_spec['df'], data_spec['x'], HISTOGRAM_BINS)
+        return {'x': (edges[:-1] + edges[1:]) / 2, 'y': counts, 'width': edges[1:] - edges[:-1]}
+
+
+class HeatmapChart(Chart):
+    # z aggregated per (x, y) pair, over the MAX_CATEGORIES most populated values of each axis.
+    # Heatmaps are drawn as one image, however many cells they have.
+    label = 'Heatmap'
+    columns = ('x', 'y', 'z')
+    numeric = ('z',)
+    max_groups = MAX_CATEGORIES
+
+    def trace(self, data_spec, representation):
+        return go.Heatmap(colorscale='Viridis')
+
+    def arrays(self, data_spec, data_dict, representation):
+        x, y, z = data_dict.aggregate_grid(
+            data_spec['df'], data_spec['x'], data_spec['y'], data_spec['z'],
+            how=data_spec.get('agg', 'sum'), max_categories=MAX_CATEGORIES
+        )
+        return {'x': x, 'y': y, 'z': z}
+
+
+# Chart types by the name stored in data specs (and used for the modal panes), in menu order
+CHARTS = {
+    'bar-chart': BarChart(),
+    'line-chart': LineChart(),
+    'pie-chart': PieChart(),
+    'scatter-chart': ScatterChart(),
+    'histogram': HistogramChart(),
+    'heatmap': HeatmapChart()
+}
+
+
+def chart_name(data_spec):
+    return data_spec.get('chart', DEFAULT_CHART)
+
+
+def get_chart(data_spec):
+    name = chart_name(data_spec)
+    if name not in CHARTS:
+        raise ValueError(f'Unknown chart type {name!r}')
+    return CHARTS[name]
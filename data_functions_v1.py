@@ -0,0 +1,629 @@
+import os
+import re
+import json
+import shutil
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+import numpy as np
+import pandas as pd
+
+AGGREGATIONS = ['sum', 'mean', 'count']
+
+# Most points a single trace is allowed to send to the browser
+MAX_POINTS = 2000
+
+# CSVs larger than this (bytes) are never loaded whole, aggregates and metadata are
+# computed by reading CHUNK_ROWS rows at a time
+STREAM_THRESHOLD = 256 * 1024 ** 2
+CHUNK_ROWS = 250000
+
+# Distinct values tracked per column when computing metadata by chunks
+MAX_DISTINCT = 100000
+
+# Values kept per axis of a two-column (heatmap) aggregate
+MAX_CATEGORIES = 100
+
+
+def lttb(x, y, n_out):
+    # Largest-Triangle-Three-Buckets downsampling of a series sorted by x
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return x, y
+
+    keep = np.empty(n_out, dtype=np.int64)
+    keep[0], keep[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        next_start, next_stop = stop, edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[next_start:next_stop].mean(), y[next_start:next_stop].mean()
+        area = np.abs(
+            (x[prev] - next_x) * (y[start:stop] - y[prev])
+            - (x[prev] - x[start:stop]) * (next_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        keep[i + 1] = prev
+    return x[keep], y[keep]
+
+
+def aggregate_xy(df, x, y, how='sum', max_points=MAX_POINTS):
+    # Groups y by x and reduces the result to at most max_points (x, y) pairs:
+    # numeric x is downsampled with LTTB, categorical x keeps its largest groups
+    numeric_x = pd.api.types.is_numeric_dtype(df[x])
+    grouped = df.groupby(x, sort=numeric_x)[y].agg(how)
+    return reduce_groups(grouped, numeric_x, max_points)
+
+
+def reduce_groups(grouped, numeric_x, max_points=MAX_POINTS):
+    if len(grouped) > max_points:
+        if numeric_x:
+            return lttb(grouped.index.to_numpy(dtype=float), grouped.to_numpy(dtype=float), max_points)
+        grouped = grouped[grouped.rank(method='first', ascending=False) <= max_points]
+
+    return grouped.index.to_numpy(), grouped.to_numpy()
+
+
+def histogram_edges(low, high, bins):
+    # The equal-width edges np.histogram would pick for values spanning [low, high]
+    if low is None or high is None:
+        return np.array([])
+    if low == high:
+        low, high = low - 0.5, high + 0.5
+    return np.linspace(low, high, bins + 1)
+
+
+def histogram_counts(values, edges):
+    return np.histogram(values.dropna().to_numpy(dtype=float), bins=edges)[0]
+
+
+def histogram2d_counts(x_values, y_values, x_edges, y_edges):
+    # Rows per (x bin, y bin), as counts[y][x]; rows missing either value are left out
+    present = x_values.notna() & y_values.notna()
+    counts = np.histogram2d(x_values[present].to_numpy(dtype=float), y_values[present].to_numpy(dtype=float), bins=[x_edges, y_edges])[0]
+    return counts.T.astype(np.int64)
+
+
+def even_rows(n, max_rows):
+    # Positions of at most max_rows rows spread evenly over n, first and last included
+    if n <= max_rows:
+        return np.arange(n)
+    return np.linspace(0, n - 1, max_rows).astype(np.int64)
+
+
+def grid_totals(df, x, y, z):
+    # Sum and count of z per (x, y) pair; unobserved category pairs are left out
+    return df.groupby([x, y], sort=False, observed=True)[z].agg(['sum', 'count'])
+
+
+def reduce_grid(totals, how='sum', max_categories=MAX_CATEGORIES):
+    # totals as from grid_totals. Keeps the max_categories most populated x and y values and
+    # returns x, y and z[y][x] (NaN where a pair has no rows), as a heatmap wants it.
+    if totals.empty:
+        return np.array([]), np.array([]), np.empty((0, 0))
+    counts = totals['count']
+    top_x = counts.groupby(level=0).sum().nlargest(max_categories).index
+    top_y = counts.groupby(level=1).sum().nlargest(max_categories).index
+    values = totals['sum'] / totals['count'] if how == 'mean' else totals[how]
+    grid = values.unstack(level=0)
+    grid = grid.loc[grid.index.isin(top_y), grid.columns.isin(top_x)].sort_index().sort_index(axis=1)
+    return grid.columns.to_numpy(), grid.index.to_numpy(), grid.to_numpy(dtype=float)
+
+
+def column_metadata(df):
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+        low, high = (series.min(), series.max()) if numeric and series.notna().any() else (None, None)
+        columns.append({
+            'name': col,
+            'dtype': str(series.dtype),
+            'numeric': bool(numeric),
+            'cardinality': int(series.nunique()),
+            'min': None if low is None else float(low),
+            'max': None if high is None else float(high)
+        })
+    return {'rows': len(df), 'columns': columns}
+
+
+def column_info(metadata, name):
+    for column in metadata['columns']:
+        if column['name'] == name:
+            return column
+    raise KeyError(name)
+
+
+def read_csv_chunks(path, usecols=None, chunksize=CHUNK_ROWS):
+    return pd.read_csv(path, usecols=usecols, chunksize=chunksize)
+
+
+def aggregate_csv(path, x, y, how='sum', max_points=MAX_POINTS, chunksize=CHUNK_ROWS):
+    # Same result as aggregate_xy in one pass over the file. Only the running per-group
+    # sums and counts are kept, so memory grows with the number of groups, not rows.
+    totals = None
+    numeric_x = True
+    for chunk in read_csv_chunks(path, usecols=list(dict.fromkeys([x, y])), chunksize=chunksize):
+        numeric_x = numeric_x and pd.api.types.is_numeric_dtype(chunk[x])
+        part = chunk.groupby(x, sort=False)[y].agg(['sum', 'count'])
+        totals = part if totals is None else pd.concat([totals, part]).groupby(level=0, sort=False).sum()
+
+    if totals is None:
+        return np.array([]), np.array([])
+    if numeric_x:
+        totals = totals.sort_index()
+
+    grouped = totals['sum'] / totals['count'] if how == 'mean' else totals[how]
+    return reduce_groups(grouped, numeric_x, max_points)
+
+
+def histogram_csv(path, x, edges, chunksize=CHUNK_ROWS):
+    counts = np.zeros(len(edges) - 1, dtype=np.int64)
+    for chunk in read_csv_chunks(path, usecols=[x], chunksize=chunksize):
+        counts += histogram_counts(chunk[x], edges)
+    return counts
+
+
+def histogram2d_csv(path, x, y, x_edges, y_edges, chunksize=CHUNK_ROWS):
+    counts = np.zeros((len(y_edges) - 1, len(x_edges) - 1), dtype=np.int64)
+    for chunk in read_csv_chunks(path, usecols=list(dict.fromkeys([x, y])), chunksize=chunksize):
+        counts += histogram2d_counts(chunk[x], chunk[y], x_edges, y_edges)
+    return counts
+
+
+def sample_csv(path, columns, step, chunksize=CHUNK_ROWS):
+    # Every step-th row of the file, read by chunks
+    parts = []
+    offset = 0
+    for chunk in read_csv_chunks(path, usecols=list(dict.fromkeys(columns)), chunksize=chunksize):
+        parts.append(chunk.iloc[(-offset) % step::step])
+        offset += len(chunk)
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(parts, ignore_index=True)[columns]
+
+
+def aggregate_grid_csv(path, x, y, z, how='sum', max_categories=MAX_CATEGORIES, chunksize=CHUNK_ROWS):
+    totals = None
+    for chunk in read_csv_chunks(path, usecols=list(dict.fromkeys([x, y, z])), chunksize=chunksize):
+        part = grid_totals(chunk, x, y, z)
+        totals = part if totals is None else pd.concat([totals, part]).groupby(level=[0, 1], sort=False).sum()
+    if totals is None:
+        return np.array([]), np.array([]), np.empty((0, 0))
+    return reduce_grid(totals, how, max_categories)
+
+
+def column_metadata_csv(path, chunksize=CHUNK_ROWS, max_distinct=MAX_DISTINCT):
+    # column_metadata by chunks. Distinct values stop being tracked past max_distinct,
+    # the cardinality of such columns is then a lower bound.
+    rows = 0
+    columns = {}
+    for chunk in read_csv_chunks(path, chunksize=chunksize):
+        rows += len(chunk)
+        for col in chunk.columns:
+            series = chunk[col]
+            numeric = pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series)
+            column = columns.setdefault(col, {'dtype': series.dtype, 'numeric': numeric, 'distinct': set(), 'cardinality': 0, 'min': None, 'max': None})
+            column['numeric'] = column['numeric'] and numeric
+            if column['dtype'] != series.dtype:
+                column['dtype'] = np.result_type(column['dtype'], series.dtype) if column['numeric'] else np.dtype(object)
+            if column['numeric'] and series.notna().any():
+                low, high = float(series.min()), float(series.max())
+                column['min'] = low if column['min'] is None else min(column['min'], low)
+                column['max'] = high if column['max'] is None else max(column['max'], high)
+            if column['distinct'] is not None:
+                column['distinct'].update(series.dropna().unique())
+                column['cardinality'] = len(column['distinct'])
+                if column['cardinality'] > max_distinct:
+                    column['distinct'] = None
+
+    return {
+        'rows': rows,
+        'columns': [
+            {
+                'name': col,
+                'dtype': str(column['dtype']),
+                'numeric': bool(column['numeric']),
+                'cardinality': int(column['cardinality']),
+                'min': column['min'] if column['numeric'] else None,
+                'max': column['max'] if column['numeric'] else None
+            }
+            for col, column in columns.items()
+        ]
+    }
+
+
+def codes_dtype(n_categories):
+    # The integer width pandas itself picks for categorical codes, anything else makes
+    # Categorical.from_codes copy them out of the memory map
+    for dtype in (np.int8, np.int16, np.int32):
+        if n_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class ColumnarCache:
+    # Binary copy of each CSV, one .npy file per column, stored under a directory named
+    # after the source file's size and mtime so an edited CSV never hits a stale entry.
+    # Numeric columns are memory-mapped on read. Object columns are stored as categorical
+    # codes (memory-mapped too) plus their distinct values, so processes reading the same
+    # entry share one copy of the data through the page cache. Streamed files only get a
+    # metadata.json in their entry.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def key(self, path):
+        stat = os.stat(path)
+        return f'{os.path.basename(path)}-{stat.st_size}-{stat.st_mtime_ns}'
+
+    def read(self, path):
+        entry = os.path.join(self.cache_dir, self.key(path))
+        try:
+            with open(os.path.join(entry, 'columns.json'), 'r') as f:
+                columns = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        data = {}
+        for i, col in enumerate(columns):
+            column_path = os.path.join(entry, f'{i}.npy')
+            codes_path = os.path.join(entry, f'{i}.codes.npy')
+            if os.path.exists(codes_path):
+                data[col] = pd.Categorical.from_codes(np.load(codes_path, mmap_mode='r'), np.load(column_path, allow_pickle=True))
+                continue
+            try:
+                data[col] = np.load(column_path, mmap_mode='r')
+            except ValueError:
+                data[col] = np.load(column_path, allow_pickle=True)
+        return pd.DataFrame(data, columns=columns, copy=False)
+
+    def write(self, path, df):
+        key = self.key(path)
+        entry = os.path.join(self.cache_dir, key)
+        tmp_entry = f'{entry}.tmp{os.getpid()}-{threading.get_ident()}'
+        try:
+            os.makedirs(tmp_entry, exist_ok=True)
+            for i, col in enumerate(df.columns):
+                values = df[col].to_numpy()
+                if values.dtype == object:
+                    codes, values = pd.factorize(values)
+                    np.save(os.path.join(tmp_entry, f'{i}.codes.npy'), codes.astype(codes_dtype(len(values))))
+                np.save(os.path.join(tmp_entry, f'{i}.npy'), values, allow_pickle=True)
+            with open(os.path.join(tmp_entry, 'columns.json'), 'w') as f:
+                json.dump(list(df.columns), f)
+            if os.path.isdir(entry) and not os.path.exists(os.path.join(entry, 'columns.json')):
+                # A metadata-only entry, its metadata is computed again from the frame
+                shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp_entry, entry)
+        except OSError:
+            # Another process already published this entry, or the cache is not writable
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+            return
+        self.purge(path, keep=key)
+
+    def read_metadata(self, path):
+        try:
+            with open(os.path.join(self.cache_dir, self.key(path), 'metadata.json'), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def write_metadata(self, path, metadata):
+        key = self.key(path)
+        entry = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(entry):
+            os.makedirs(entry, exist_ok=True)
+            self.purge(path, keep=key)
+        tmp_path = os.path.join(entry, f'.metadata{os.getpid()}-{threading.get_ident()}.json')
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, os.path.join(entry, 'metadata.json'))
+
+    def purge(self, path, keep=None):
+        # Only entries of this exact file, <basename>-<size>-<mtime>, not of 's.csv-old.csv' for 's.csv'
+        entry_name = re.compile(re.escape(os.path.basename(path)) + r'-\d+-\d+')
+        for name in os.listdir(self.cache_dir):
+            if entry_name.fullmatch(name) and name != keep:
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+
+class DataRegistry(Mapping):
+    # Behaves like the old {filename: DataFrame} dict, but only the listing and the
+    # column names are read at startup. Frames are parsed on first access and the
+    # least recently used ones are evicted once memory_budget (bytes) is exceeded.
+    # With a cache_dir, parsed CSVs are kept in a ColumnarCache across restarts.
+    # Files over stream_threshold bytes are never parsed whole: aggregate and metadata
+    # read them in chunks instead. Each file is parsed (and its metadata computed) by one
+    # thread at a time, concurrent callers wait for that load instead of repeating it.
+
+    def __init__(self, data_dir='data', memory_budget=512 * 1024 ** 2, cache_dir=None, stream_threshold=STREAM_THRESHOLD):
+        self.data_dir = data_dir
+        self.memory_budget = memory_budget
+        self.stream_threshold = stream_threshold
+        self.cache = ColumnarCache(cache_dir) if cache_dir else None
+        self._lock = threading.RLock()
+        self._load_locks = {}
+        self._frames = OrderedDict()
+        self._frame_bytes = {}
+        self._frame_versions = {}
+        self._metadata = {}
+        self._schemas = {}
+        self._versions = {}
+        self.scan()
+
+    def scan(self):
+        # Re-lists data_dir and returns the files added, changed or removed since the last
+        # call. Only those have their header re-read and their parsed frame dropped.
+        versions = {}
+        for filename in sorted(filename for filename in os.listdir(self.data_dir) if filename.endswith('.csv')):
+            try:
+                versions[filename] = self.version(filename)
+            except FileNotFoundError:
+                pass
+
+        with self._lock:
+            changed = {filename for filename in set(versions) | set(self._versions) if versions.get(filename) != self._versions.get(filename)}
+        schemas = {filename: list(pd.read_csv(self.path(filename), nrows=0).columns) for filename in changed if filename in versions}
+
+        with self._lock:
+            self._schemas = {filename: schemas.get(filename, self._schemas.get(filename)) for filename in versions}
+            self._versions = versions
+            for filename in changed:
+                self._evict(filename)
+                self._metadata.pop(filename, None)
+        return changed
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def path(self, filename):
+        return os.path.join(self.data_dir, filename)
+
+    def version(self, filename):
+        stat = os.stat(self.path(filename))
+        return f'{stat.st_size}-{stat.st_mtime_ns}'
+
+    def columns(self, filename):
+        return self._schemas[filename]
+
+    def _load_lock(self, filename):
+        # Reentrant, metadata holds it while __getitem__ parses the same file
+        with self._lock:
+            return self._load_locks.setdefault(filename, threading.RLock())
+
+    def _cached_metadata(self, filename, version):
+        with self._lock:
+            cached = self._metadata.get(filename)
+            if cached is not None and cached['version'] == version:
+                return cached
+
+    def metadata(self, filename):
+        # Column names, dtypes, row count, cardinality and min/max, computed once per file version.
+        # Only listed files, names come from the browser and must not reach the filesystem.
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        version = self.version(filename)
+        cached = self._cached_metadata(filename, version)
+        if cached is not None:
+            return cached
+
+        with self._load_lock(filename):
+            cached = self._cached_metadata(filename, version)
+            if cached is not None:
+                return cached
+
+            metadata = self.cache.read_metadata(self.path(filename)) if self.cache else None
+            if metadata is None or metadata.get('version') != version:
+                if self.streamed(filename):
+                    metadata = dict(column_metadata_csv(self.path(filename)), version=version)
+                else:
+                    metadata = dict(column_metadata(self[filename]), version=version)
+                if self.cache:
+                    self.cache.write_metadata(self.path(filename), metadata)
+
+            with self._lock:
+                self._metadata[filename] = metadata
+        return metadata
+
+    def memory_usage(self):
+        with self._lock:
+            return sum(self._frame_bytes.values())
+
+    def _cached_frame(self, filename, version):
+        with self._lock:
+            if filename in self._frames and self._frame_versions[filename] == version:
+                self._frames.move_to_end(filename)
+                return self._frames[filename]
+
+    def __getitem__(self, filename):
+        if filename not in self._schemas:
+            raise KeyError(filename)
+
+        version = self.version(filename)
+        df = self._cached_frame(filename, version)
+        if df is not None:
+            return df
+
+        with self._load_lock(filename):
+            df = self._cached_frame(filename, version)
+            if df is not None:
+                return df
+
+            df = self._read(filename)
+
+            with self._lock:
+                self._frames[filename] = df
+                self._frames.move_to_end(filename)
+                self._frame_bytes[filename] = int(df.memory_usage(deep=True).sum())
+                self._frame_versions[filename] = version
+                self._schemas[filename] = list(df.columns)
+                self._enforce_budget()
+        return df
+
+    def prewarm(self):
+        # Writes the columnar cache entry of every dataset that is loaded whole, without
+        # keeping the frames. Run once before forking workers, they then all memory-map
+        # the same files instead of each parsing the CSVs.
+        warmed = []
+        for filename in list(self._schemas):
+            if self.cache is None or self.streamed(filename) or self.cache.read(self.path(filename)) is not None:
+                continue
+            self.cache.write(self.path(filename), pd.read_csv(self.path(filename)))
+            warmed.append(filename)
+        return warmed
+
+    def streamed(self, filename):
+        return os.path.getsize(self.path(filename)) > self.stream_threshold
+
+    def aggregate(self, filename, x, y, how='sum', max_points=MAX_POINTS):
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        if self.streamed(filename):
+            return aggregate_csv(self.path(filename), x, y, how=how, max_points=max_points)
+        return aggregate_xy(self[filename], x, y, how=how, max_points=max_points)
+
+    def histogram(self, filename, x, bins):
+        # Equal-width bins between the column's min and max, returns (edges, counts)
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        column = column_info(self.metadata(filename), x)
+        edges = histogram_edges(column['min'], column['max'], bins)
+        if not len(edges):
+            return edges, np.array([], dtype=np.int64)
+        if self.streamed(filename):
+            return edges, histogram_csv(self.path(filename), x, edges)
+        return edges, histogram_counts(self[filename][x], edges)
+
+    def histogram2d(self, filename, x, y, bins):
+        # bins x bins equal-width cells over both columns' ranges, returns (x_edges, y_edges, counts[y][x])
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        metadata = self.metadata(filename)
+        x_edges, y_edges = [histogram_edges(column_info(metadata, name)['min'], column_info(metadata, name)['max'], bins) for name in (x, y)]
+        if not len(x_edges) or not len(y_edges):
+            return x_edges, y_edges, np.zeros((max(len(y_edges) - 1, 0), max(len(x_edges) - 1, 0)), dtype=np.int64)
+        if self.streamed(filename):
+            return x_edges, y_edges, histogram2d_csv(self.path(filename), x, y, x_edges, y_edges)
+        df = self[filename]
+        return x_edges, y_edges, histogram2d_counts(df[x], df[y], x_edges, y_edges)
+
+    def sample(self, filename, columns, max_rows):
+        # At most max_rows rows of the given columns, spread evenly over the file
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        if self.streamed(filename):
+            step = max(1, -(-self.metadata(filename)['rows'] // max_rows))
+            return sample_csv(self.path(filename), columns, step)
+        df = self[filename]
+        return df[columns].iloc[even_rows(len(df), max_rows)]
+
+    def aggregate_grid(self, filename, x, y, z, how='sum', max_categories=MAX_CATEGORIES):
+        if filename not in self._schemas:
+            raise KeyError(filename)
+        if self.streamed(filename):
+            return aggregate_grid_csv(self.path(filename), x, y, z, how=how, max_categories=max_categories)
+        return reduce_grid(grid_totals(self[filename], x, y, z), how, max_categories)
+
+    def __iter__(self):
+        return iter(self._schemas)
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def __contains__(self, filename):
+        return filename in self._schemas
+
+    def _read(self, filename):
+        path = self.path(filename)
+        if self.cache is None:
+            return pd.read_csv(path)
+
+        df = self.cache.read(path)
+        if df is None:
+            df = pd.read_csv(path)
+            self.cache.write(path, df)
+            # Read back, so text columns are categorical on a cold load as on a warm one
+            cached = self.cache.read(path)
+            if cached is not None:
+                df = cached
+        return df
+
+    def _evict(self, filename):
+        self._frames.pop(filename, None)
+        self._frame_bytes.pop(filename, None)
+        self._frame_versions.pop(filename, None)
+
+    def _enforce_budget(self):
+        # The most recently used frame is always kept, even if it alone exceeds the budget
+        while len(self._frames) > 1 and sum(self._frame_bytes.values()) > self.memory_budget:
+            self._evict(next(iter(self._frames)))
+
+
+class CompositeDataSource(Mapping):
+    # Several sources (DataRegistry, SQLiteDataSource, ...) behind the one data_dict
+    # interface. Each dataset name is served by the first source that has it.
+
+    def __init__(self, *sources):
+        self.sources = sources
+
+    def source(self, name):
+        for source in self.sources:
+            if name in source:
+                return source
+        raise KeyError(name)
+
+    def scan(self):
+        return set().union(*(source.scan() for source in self.sources))
+
+    def prewarm(self):
+        return [filename for source in self.sources if hasattr(source, 'prewarm') for filename in source.prewarm()]
+
+    def versions(self):
+        versions = {}
+        for source in reversed(self.sources):
+            versions.update(source.versions())
+        return versions
+
+    def version(self, name):
+        return self.source(name).version(name)
+
+    def columns(self, name):
+        return self.source(name).columns(name)
+
+    def metadata(self, name):
+        return self.source(name).metadata(name)
+
+    def aggregate(self, name, x, y, how='sum', max_points=MAX_POINTS):
+        return self.source(name).aggregate(name, x, y, how=how, max_points=max_points)
+
+    def histogram(self, name, x, bins):
+        return self.source(name).histogram(name, x, bins)
+
+    def histogram2d(self, name, x, y, bins):
+        return self.source(name).histogram2d(name, x, y, bins)
+
+    def sample(self, name, columns, max_rows):
+        return self.source(name).sample(name, columns, max_rows)
+
+    def aggregate_grid(self, name, x, y, z, how='sum', max_categories=MAX_CATEGORIES):
+        return self.source(name).aggregate_grid(name, x, y, z, how=how, max_categories=max_categories)
+
+    def __getitem__(self, name):
+        return self.source(name)[name]
+
+    def __iter__(self):
+        seen = set()
+        for source in self.sources:
+            for name in source:
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __contains__(self, name):
+        return any(name in source for source in self.sources)
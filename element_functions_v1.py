@@ -0,0 +1,203 @@
+import math
+import json
+import functools
+import plotly.graph_objects as go
+from chart_functions_v1 import get_chart
+
+# Version of the stored element format. Older elements are upgraded by UPGRADES when loaded
+# and written back in this format on the next save.
+ELEMENT_SCHEMA = 2
+
+ELEMENT_TYPES = ('h1', 'p', 'div')
+GEOMETRY = ('top', 'left', 'height', 'width')
+
+# Geometry is percent of the window, stored with this many decimals (0.01% of 1920px is 0.2px)
+GEOMETRY_DECIMALS = 2
+
+
+@functools.lru_cache(maxsize=None)
+def default_template():
+    return json.loads(go.Figure().to_json())['layout']['template']
+
+
+def strip_default_template(layout):
+    # Figures serialised by plotly carry the whole default template (~7KB), go.Figure adds it back
+    if isinstance(layout, dict) and layout.get('template') == default_template():
+        return {key: value for key, value in layout.items() if key != 'template'}
+    return layout
+
+
+def parse_percent(value):
+    # '14.8%' as written by schema 1 and the browser, or a plain number
+    if isinstance(value, str):
+        value = value.strip()
+        if not value.endswith('%'):
+            raise ValueError(f'Expected a percentage, got {value!r}')
+        value = value[:-1]
+    return float(value)
+
+
+def check_data_spec(data):
+    if not isinstance(data, dict):
+        raise ValueError(f'Graph data must be a dict, got {data!r}')
+    get_chart(data).check(data)
+    return dict(data)
+
+
+class Element:
+    # One saved layout element, validated once when the layout is loaded. Geometry is in
+    # percent of the window as floats. Graphs (type 'div') have a data spec and a plotly
+    # layout, h1 / p elements their text.
+
+    __slots__ = ('id', 'type', 'top', 'left', 'height', 'width', 'text', 'layout', 'data')
+
+    def __init__(self, id, type, top, left, height, width, text='', layout=None, data=None):
+        self.id = id
+        self.type = type
+        self.top = top
+        self.left = left
+        self.height = height
+        self.width = width
+        self.text = text
+        self.layout = layout
+        self.data = data
+
+    @property
+    def graph(self):
+        return self.data is not None
+
+    def style(self):
+        return {key: f'{getattr(self, key)}%' for key in GEOMETRY}
+
+    @classmethod
+    def from_dict(cls, stored):
+        # stored is in the current schema, see upgrade_v1 for the older one
+        element_type = stored.get('type')
+        if element_type not in ELEMENT_TYPES:
+            raise ValueError(f'Unknown element type {element_type!r}')
+        if not isinstance(stored.get('id'), str) or not stored['id']:
+            raise ValueError(f"Invalid element id {stored.get('id')!r}")
+        geometry = [float(stored[key]) for key in GEOMETRY]
+        if not all(math.isfinite(value) for value in geometry):
+            raise ValueError(f'Invalid geometry {geometry!r}')
+
+        if element_type == 'div':
+            layout = stored.get('layout') or {}
+            if not isinstance(layout, dict):
+                raise ValueError(f'Graph layout must be a dict, got {layout!r}')
+            return cls(stored['id'], element_type, *geometry, layout=layout, data=check_data_spec(stored.get('data')))
+        return cls(stored['id'], element_type, *geometry, text=str(stored.get('text') or ''))
+
+    def to_dict(self):
+        stored = {'id': self.id, 'type': self.type}
+        stored.update((key, round(getattr(self, key), GEOMETRY_DECIMALS)) for key in GEOMETRY)
+        if self.text:
+            stored['text'] = self.text
+        if self.graph:
+            stored['layout'] = self.layout
+            stored['data'] = self.data
+        return stored
+
+
+class InvalidElement:
+    # A stored element that failed validation. It is kept exactly as stored, so saving the
+    # layout again does not lose it, and createElement shows it as an error box. schema is
+    # the one it was stored in; when that is older than the layout it is saved into, the
+    # element carries its own 'schema' key so it is not read as the newer format.
+
+    __slots__ = ('id', 'raw', 'error', 'schema')
+    type = 'invalid'
+    text = ''
+    layout = None
+    data = None
+    graph = False
+
+    def __init__(self, raw, error, schema=ELEMENT_SCHEMA):
+        self.raw = raw
+        self.id = raw.get('id') if isinstance(raw, dict) else None
+        self.error = f'{error.__class__.__name__}: {error}'
+        self.schema = schema
+
+    def style(self):
+        raw = self.raw if isinstance(self.raw, dict) else {}
+        return {key: f'{raw[key]}%' if isinstance(raw.get(key), (int, float)) else raw.get(key) for key in GEOMETRY}
+
+    def to_dict(self):
+        if self.schema != ELEMENT_SCHEMA and isinstance(self.raw, dict):
+            return dict(self.raw, schema=self.schema)
+        return self.raw
+
+
+def upgrade_v1(stored):
+    # Schema 1, which is also what the browser sends: geometry as '12.5%' strings, a 'graph'
+    # flag, '' for unused text / layout / data and the default template in every graph layout
+    upgraded = {'id': stored.get('id'), 'type': stored.get('type'), 'text': stored.get('text') or ''}
+    upgraded.update((key, parse_percent(stored.get(key))) for key in GEOMETRY)
+    if stored.get('graph'):
+        upgraded['layout'] = strip_default_template(stored.get('layout') or {})
+        upgraded['data'] = stored.get('data')
+    return upgraded
+
+
+UPGRADES = {1: upgrade_v1}
+
+
+def parse_layout(stored_layout, schema=1):
+    layout = []
+    for stored in stored_layout:
+        # Invalid elements kept from an older schema say so themselves, see InvalidElement
+        element_schema = stored.get('schema', schema) if isinstance(stored, dict) else schema
+        try:
+            upgraded = stored
+            for version in range(element_schema, ELEMENT_SCHEMA):
+                upgraded = UPGRADES[version](upgraded)
+            layout.append(Element.from_dict(upgraded))
+        except (AttributeError, KeyError, TypeError, ValueError) as error:
+            layout.append(InvalidElement(stored, error, element_schema))
+    return layout
+
+
+def is_error_box(posted):
+    # The browser describes error boxes (invalid elements) only by id, see describeElement
+    return isinstance(posted, dict) and posted.get('invalid') is True
+
+
+def parse_posted_layout(posted_layout, stored_layout):
+    # A full save from the browser. Error boxes keep the element as stored, whatever the
+    # box itself was moved to.
+    stored = {element.id: element for element in stored_layout}
+    layout = []
+    for posted in posted_layout:
+        if not is_error_box(posted):
+            layout.extend(parse_layout([posted]))
+        elif posted.get('id') in stored:
+            layout.append(stored[posted['id']])
+    return layout
+
+
+def layout_record(layout, **fields):
+    return dict(fields, layout=[element.to_dict() for element in layout], schema=ELEMENT_SCHEMA)
+
+
+def layout_from_record(record):
+    # A bare list is a layout stored before schemas existed
+    if isinstance(record, list):
+        return parse_layout(record, 1)
+    return parse_layout(record['layout'], record.get('schema', 1))
+
+
+def diff_record(diff):
+    record = {'changed': [element.to_dict() for element in diff.get('changed', [])], 'removed': list(diff.get('removed', [])), 'schema': ELEMENT_SCHEMA}
+    if diff.get('order'):
+        record['order'] = diff['order']
+    return record
+
+
+def diff_from_record(record):
+    # Diffs posted by saveLayoutTest have no schema, their elements are in schema 1. Error
+    # boxes are never saved over the element they stand for.
+    changed = [element for element in record.get('changed', []) if not is_error_box(element)]
+    diff = {'changed': parse_layout(changed, record.get('schema', 1)), 'removed': record.get('removed', [])}
+    if record.get('order'):
+        diff['order'] = record['order']
+    return diff
@@ -0,0 +1,154 @@
+import json
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import quote, urlencode
+import numpy as np
+import plotly.graph_objects as go
+from chart_functions_v1 import get_chart, point_budget, SVG, WEBGL, BINNED
+from element_functions_v1 import strip_default_template
+
+# Route the browser fetches chart arrays from, see data_url / build_payload
+DATA_ROUTE = '/dashboard-data/'
+
+# Values of the data URL's draw parameter
+REPRESENTATIONS = (SVG, WEBGL, BINNED)
+
+
+class FigureCache:
+    # Bounded LRU of figures (or data payloads) already converted to plain JSON, keyed by
+    # the dataset they read plus a hash of the element's data spec and layout. Each entry
+    # remembers the dataset version it was built from and is rebuilt once the file changes.
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def key(self, dataset, *parts):
+        digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+        return (dataset, digest)
+
+    def get(self, dataset, version, parts, build):
+        key = self.key(dataset, *parts)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        figure = build()
+
+        with self._lock:
+            self._entries[key] = (version, figure)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return figure
+
+    def invalidate(self, dataset=None):
+        with self._lock:
+            for key in [key for key in self._entries if dataset is None or key[0] == dataset]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+figure_cache = FigureCache()
+
+
+def encode_array(values):
+    # Numeric arrays travel as base64 little-endian buffers the browser turns into typed
+    # arrays; anything else (categories, dates) stays a plain JSON list, as do 2D arrays
+    # (heatmap z), which plotly.js does not take as typed arrays
+    values = np.asarray(values)
+    if values.ndim > 1:
+        return [[None if value != value else value for value in row] for row in values.tolist()]
+    if values.dtype.kind == 'b':
+        values = values.astype('<u1')
+    elif values.dtype.kind in 'iu' and len(values) and np.iinfo(np.int32).min <= values.min() and values.max() <= np.iinfo(np.int32).max:
+        values = values.astype('<i4')
+    elif values.dtype.kind in 'iuf':
+        values = values.astype('<f8')
+    else:
+        return [None if value != value else value for value in values.tolist()]
+    return {'dtype': values.dtype.str[1:], 'bdata': base64.b64encode(values.tobytes()).decode('ascii')}
+
+
+def data_url(data_spec, version, drawn_as=None):
+    # drawn_as is the representation the graph's skeleton was built for. The server sends
+    # arrays for that representation, even once the dataset has grown past its budget,
+    # so a refresh (which only moves v) never gives a trace arrays of another type.
+    query = {key: value for key, value in get_chart(data_spec).data_key(data_spec).items() if key != 'df'}
+    if drawn_as is not None:
+        query['draw'] = drawn_as
+    query['v'] = version
+    return f"{DATA_ROUTE}{quote(data_spec['df'])}?{urlencode(query)}"
+
+
+def representation(chart, data_spec, data_dict):
+    # SVG, WebGL or binned, by the trace's size against the point budget
+    return point_budget.representation(chart.points(data_spec, data_dict))
+
+
+def graph_representation(data_spec, data_dict):
+    return representation(get_chart(data_spec), data_spec, data_dict)
+
+
+def build_figure(data_spec, layout, data_dict):
+    chart = get_chart(data_spec)
+    drawn_as = representation(chart, data_spec, data_dict)
+    trace = chart.trace(data_spec, drawn_as).update(**chart.arrays(data_spec, data_dict, drawn_as))
+    return go.Figure(data=[trace], layout=layout)
+
+
+def build_skeleton(data_spec, layout, drawn_as):
+    return go.Figure(data=[get_chart(data_spec).trace(data_spec, drawn_as)], layout=layout)
+
+
+def build_payload(data_spec, data_dict, drawn_as):
+    arrays = get_chart(data_spec).arrays(data_spec, data_dict, drawn_as)
+    return {attr: encode_array(values) for attr, values in arrays.items()}
+
+
+def cached_figure(data_spec, layout, data_dict):
+    dataset = data_spec['df']
+    return figure_cache.get(
+        dataset,
+        data_dict.version(dataset),
+        (data_spec, layout),
+        lambda: json.loads(build_figure(data_spec, layout, data_dict).to_json())
+    )
+
+
+def skeleton_json(data_spec, layout, drawn_as):
+    # Without the default template, the page carries it once for all graphs (see serve_layout)
+    figure = json.loads(build_skeleton(data_spec, layout, drawn_as).to_json())
+    figure['layout'] = strip_default_template(figure['layout'])
+    return figure
+
+
+def cached_skeleton(data_spec, layout, data_dict, drawn_as):
+    dataset = data_spec['df']
+    return figure_cache.get(
+        dataset,
+        data_dict.version(dataset),
+        (data_spec, layout, drawn_as, 'skeleton'),
+        lambda: skeleton_json(data_spec, layout, drawn_as)
+    )
+
+
+def cached_payload(data_spec, data_dict, drawn_as):
+    dataset = data_spec['df']
+    return figure_cache.get(
+        dataset,
+        data_dict.version(dataset),
+        (get_chart(data_spec).data_key(data_spec), drawn_as, point_budget.key(), 'payload'),
+        lambda: build_payload(data_spec, data_dict, drawn_as)
+    )
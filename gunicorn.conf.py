@@ -0,0 +1,23 @@
+### gunicorn -c gunicorn.conf.py wsgi:server
+import os
+import multiprocessing
+
+bind = os.environ.get('DASHBOARD_BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('DASHBOARD_WORKERS', multiprocessing.cpu_count()))
+threads = int(os.environ.get('DASHBOARD_THREADS', 4))
+
+# Import the app (and prewarm the data cache, see wsgi.py) once before forking
+preload_app = True
+
+# createBody on a large saved layout can take a while on a cold cache
+timeout = 120
+
+def post_fork(server, worker):
+    ### SQL connections opened while the master imported the app are not reused after fork
+    from app_v4 import data_dict, prewarmer
+    for source in getattr(data_dict, 'sources', [data_dict]):
+        pool = getattr(source, 'pool', None)
+        if pool is not None:
+            pool.after_fork()
+    ### Threads do not survive the fork, each worker runs its own cache warming
+    prewarmer.start()
@@ -1,87 +1,130 @@
-import dash_core_components as dcc
 import dash_html_components as html
-import plotly.graph_objects as go
 import os
+import json
+import time
+import traceback
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from figure_functions_v1 import cached_skeleton, data_url, graph_representation
+from element_functions_v1 import InvalidElement
+from chart_functions_v1 import get_chart
 
 def createH1(element, data_dict):
     return html.H1(
-        id=element['id'], 
+        id=element.id, 
         className='draggable', 
         style={
             'border': '1px black solid',
             'position': 'absolute',
-            'top': element['top'],
-            'left': element['left'],
-            'height': element['height'],
-            'width': element['width']
+            **element.style()
         }, 
-        children=element['text']
+        children=element.text
     )
 
 def createP(element, data_dict):
     return html.P(
-        id=element['id'], 
+        id=element.id, 
         className='draggable', 
         style={
             'border': '1px black solid',
             'position': 'absolute',
-            'top': element['top'],
-            'left': element['left'],
-            'height': element['height'],
-            'width': element['width']
+            **element.style()
         }, 
-        children=element['text']
+        children=element.text
     )
 
 def createGraph(element, data_dict):
-    fig = go.Figure(
-        data=[
-            go.Bar(
-                x=data_dict[element['data']['df']][element['data']['x']],
-                y=data_dict[element['data']['df']][element['data']['y']],
-                marker_color=element['data']['marker_color']
-            )
-        ],
-        layout=element["layout"]
-    )
+    ### Only a placeholder is rendered. The figure (trace style and layout) travels in data-figure and
+    ### assets/test.js draws it, with the arrays from data-src, once the element scrolls into view
+    missing = {element.data[key] for key in get_chart(element.data).columns} - set(data_dict.columns(element.data['df']))
+    if missing:
+        raise KeyError(f"{element.data['df']} has no column(s) {sorted(missing)}")
+    drawn_as = graph_representation(element.data, data_dict)
+    fig = cached_skeleton(element.data, element.layout, data_dict, drawn_as)
 
     return html.Div(
-        id=element['id'], 
+        id=element.id, 
         className='draggable graph', 
+        **{
+            'data-src': data_url(element.data, data_dict.version(element.data['df']), drawn_as),
+            'data-figure': json.dumps(fig)
+        },
         style={
             #'border': '1px black solid',
             'position': 'absolute',
-            'top': element['top'],
-            'left': element['left'],
-            'height': element['height'],
-            'width': element['width']
+            **element.style()
         }, 
         children=[
             html.Div([
                 html.I(
-                    id={'action':'edit', 'input_id':element['id']},
+                    id={'action':'edit', 'input_id':element.id},
                     className="fas fa-pencil-alt m-2 h3",
                     style={'cursor':'pointer'}
                 ),
                 html.I(
-                    id={'action':'delete', 'input_id':element['id']},
+                    id={'action':'delete', 'input_id':element.id},
                     className="fas fa-trash-alt m-2 h3",
                     style={'cursor':'pointer'}
                 )
             ], style={'position':'absolute', 'right':0, 'zIndex':10}),
-            dcc.Graph(figure=fig, style={'height': '100%', 'width': '100%', 'border': '1px black solid'})
+            html.Div(className='graph-placeholder', style={'height': '100%', 'width': '100%', 'border': '1px black solid'})
         ]
     )
 
+def createErrorElement(element, error):
+    ### 'invalid' tells saveLayoutTest to keep the stored element rather than save this box
+    return html.Div(
+        id=element.id, 
+        className='draggable invalid', 
+        style={
+            'border': '1px red solid',
+            'position': 'absolute',
+            **element.style()
+        }, 
+        children=f"Could not render {element.id}: {error!r}"
+    )
+
 def createElement(element, element_key, data_dict):
-    createFunction = element_key[element['type']]
+    ### Elements that failed validation when the layout was loaded become error boxes
+    if isinstance(element, InvalidElement):
+        raise ValueError(element.error)
+    createFunction = element_key[element.type]
     return createFunction(element, data_dict)
 
-def createBody(saved_layout, element_key, data_dict):
-    body = [createElement(element, element_key, data_dict) for element in saved_layout]
+def timedCreateElement(element, element_key, data_dict, errors=None):
+    ### One bad element is replaced by an error box instead of failing the whole body
+    start = time.perf_counter()
+    try:
+        created = createElement(element, element_key, data_dict)
+    except Exception as error:
+        if errors is None:
+            traceback.print_exc()
+        else:
+            errors.append((element, error))
+        created = createErrorElement(element, error)
+    return created, element.type, time.perf_counter() - start
+
+def createBody(saved_layout, element_key, data_dict, max_workers=None, timings=None, errors=None):
+    ### With max_workers the elements are built on a thread pool, pool.map keeps the saved order.
+    ### timings, if given, collects {element type: {'count', 'total', 'max'}} in seconds.
+    ### errors, if given, collects (element, exception) for each error box instead of printing tracebacks.
+    create = lambda element: timedCreateElement(element, element_key, data_dict, errors)
+    if max_workers and len(saved_layout) > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(create, saved_layout))
+    else:
+        results = [create(element) for element in saved_layout]
+
+    if timings is not None:
+        for _, element_type, duration in results:
+            timing = timings.setdefault(element_type, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timing['count'] += 1
+            timing['total'] += duration
+            timing['max'] = max(timing['max'], duration)
+
+    body = [created for created, _, _ in results]
     return body
 
 def createDataStore(saved_layout):
-    dataStore = {element['id']: element['data'] for element in saved_layout if element['graph']}
+    dataStore = {element.id: element.data for element in saved_layout if element.graph}
     return dataStore
\ No newline at end of file
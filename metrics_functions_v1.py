@@ -0,0 +1,148 @@
+import json
+import bisect
+import threading
+from collections import deque
+
+# Histogram bucket upper bounds, seconds and bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Quantiles reported over the last RECENT_WINDOW requests of each callback
+QUANTILES = (0.5, 0.9, 0.99)
+RECENT_WINDOW = 1024
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in labels) + '}' if labels else ''
+
+
+def trigger_label(prop_id):
+    # Pattern-matching ids carry element ids (e.g. {"action":"delete","input_id":"test-graph-1a2b"}),
+    # which would make one series per element; only the id's shape is kept
+    component_id, _, prop = (prop_id or '').rpartition('.')
+    if component_id.startswith('{'):
+        try:
+            parsed = json.loads(component_id)
+        except ValueError:
+            return prop_id
+        component_id = json.dumps({key: value for key, value in parsed.items() if key != 'input_id'}, sort_keys=True, separators=(',', ':'))
+    return f'{component_id}.{prop}' if component_id else prop
+
+
+class Histogram:
+    # Cumulative Prometheus histogram plus a ring of the most recent observations for quantiles
+
+    def __init__(self, buckets, window=RECENT_WINDOW):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        self.recent.append(value)
+
+    def quantiles(self, quantiles=QUANTILES):
+        recent = sorted(self.recent)
+        if not recent:
+            return []
+        return [(q, recent[min(len(recent) - 1, int(q * len(recent)))]) for q in quantiles]
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'{name}_bucket{format_labels(labels + [("le", le)])} {cumulative}')
+        lines.append(f'{name}_sum{format_labels(labels)} {self.sum}')
+        lines.append(f'{name}_count{format_labels(labels)} {self.count}')
+        return lines
+
+
+class CallbackMetrics:
+    # Per-callback latency and payload sizes, trigger and error counts, plus any counters
+    # registered with add_counter (read at scrape time, e.g. cache hits and misses).
+    # observe() only takes a lock and updates a few numbers, so it is left on everywhere.
+
+    def __init__(self, prefix='dashboard'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._request_bytes = {}
+        self._response_bytes = {}
+        self._triggers = {}
+        self._errors = {}
+        self._elements = {}
+        self._counters = {}
+
+    def observe(self, callback, trigger, duration, request_bytes, response_bytes, status=200):
+        with self._lock:
+            if callback not in self._latency:
+                self._latency[callback] = Histogram(LATENCY_BUCKETS)
+                self._request_bytes[callback] = Histogram(SIZE_BUCKETS)
+                self._response_bytes[callback] = Histogram(SIZE_BUCKETS)
+            self._latency[callback].observe(duration)
+            self._request_bytes[callback].observe(request_bytes or 0)
+            self._response_bytes[callback].observe(response_bytes or 0)
+            key = (callback, trigger)
+            self._triggers[key] = self._triggers.get(key, 0) + 1
+            if status >= 500:
+                self._errors[callback] = self._errors.get(callback, 0) + 1
+
+    def observe_elements(self, timings):
+        # timings as collected by createBody: {element type: {'count', 'total', 'max'}}
+        with self._lock:
+            for element_type, timing in timings.items():
+                current = self._elements.setdefault(str(element_type), {'count': 0, 'total': 0.0, 'max': 0.0})
+                current['count'] += timing['count']
+                current['total'] += timing['total']
+                current['max'] = max(current['max'], timing['max'])
+
+    def add_counter(self, name, help_text, read, labels=()):
+        self._counters.setdefault(name, (help_text, []))[1].append((list(labels), read))
+
+    def render(self):
+        prefix = self.prefix
+        lines = []
+        with self._lock:
+            for name, help_text, histograms in (
+                ('callback_duration_seconds', 'Server-side callback time', self._latency),
+                ('callback_request_bytes', 'Callback request body size', self._request_bytes),
+                ('callback_response_bytes', 'Callback response body size', self._response_bytes),
+            ):
+                lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} histogram']
+                for callback, histogram in sorted(histograms.items()):
+                    lines += histogram.render(f'{prefix}_{name}', [('callback', callback)])
+
+            lines += [f'# HELP {prefix}_callback_recent_duration_seconds Callback time over the last {RECENT_WINDOW} calls', f'# TYPE {prefix}_callback_recent_duration_seconds summary']
+            for callback, histogram in sorted(self._latency.items()):
+                for q, value in histogram.quantiles():
+                    lines.append(f'{prefix}_callback_recent_duration_seconds{format_labels([("callback", callback), ("quantile", q)])} {value}')
+
+            lines += [f'# HELP {prefix}_callback_triggers_total Callback calls by triggering property', f'# TYPE {prefix}_callback_triggers_total counter']
+            for (callback, trigger), count in sorted(self._triggers.items()):
+                lines.append(f'{prefix}_callback_triggers_total{format_labels([("callback", callback), ("trigger", trigger)])} {count}')
+
+            lines += [f'# HELP {prefix}_callback_errors_total Callback calls answered with a 5xx', f'# TYPE {prefix}_callback_errors_total counter']
+            for callback, count in sorted(self._errors.items()):
+                lines.append(f'{prefix}_callback_errors_total{format_labels([("callback", callback)])} {count}')
+
+            lines += [f'# HELP {prefix}_elements_rendered_total Saved-layout elements built by createBody', f'# TYPE {prefix}_elements_rendered_total counter']
+            lines += [f'{prefix}_elements_rendered_total{format_labels([("type", element_type)])} {timing["count"]}' for element_type, timing in sorted(self._elements.items())]
+            lines += [f'# HELP {prefix}_element_render_seconds_total Time spent building saved-layout elements', f'# TYPE {prefix}_element_render_seconds_total counter']
+            lines += [f'{prefix}_element_render_seconds_total{format_labels([("type", element_type)])} {timing["total"]}' for element_type, timing in sorted(self._elements.items())]
+            lines += [f'# HELP {prefix}_element_render_max_seconds Slowest single element build', f'# TYPE {prefix}_element_render_max_seconds gauge']
+            lines += [f'{prefix}_element_render_max_seconds{format_labels([("type", element_type)])} {timing["max"]}' for element_type, timing in sorted(self._elements.items())]
+
+        for name, (help_text, series) in self._counters.items():
+            lines += [f'# HELP {prefix}_{name} {help_text}', f'# TYPE {prefix}_{name} counter']
+            lines += [f'{prefix}_{name}{format_labels(labels)} {read()}' for labels, read in series]
+        return '\n'.join(lines) + '\n'
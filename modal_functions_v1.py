@@ -2,6 +2,7 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import plotly.graph_objects as go
+from chart_functions_v1 import CHARTS, DEFAULT_CHART
 
 def populate_header(trigger_action, trigger_type, id=None):
     text = f'Create new {trigger_type}' if trigger_action == 'create' else f'Edit {id}'
@@ -28,54 +29,71 @@ def populate_footer(trigger_action):
                     ]
     return children
 
-def make_accordion_item(title, content):
+def make_accordion_item(title, content, key=None):
     return dbc.Card(
         [
             html.Button(
                 html.H2(title),
-                id={'action':'collapse-but', 'key':title}
+                id={'action':'collapse-but', 'key':key or title}
             ),
             dbc.Collapse(
                 dbc.CardBody(content),
-                id={'action':'collapse-card', 'key':title},
+                id={'action':'collapse-card', 'key':key or title},
                 is_open=False
             ),
         ]
     )
 
-def make_data_panel(trigger_type, data_dict, *arg):
+def make_column_select(trigger_type, chart, key):
+    ### One select per column the chart reads, e.g. input_id 'x-col-dd'
     return [
         dbc.InputGroup(
             [
-                dbc.Label('Data', className='col-3'), 
+                dbc.Label(chart.column_label(key), className='col-3'), 
                 dbc.Select(
-                    id={'type':'input', 'plot':trigger_type, 'input_id':'data-dd', 'panel':'data'}, 
-                    className='col-8',
-                    options = [{'label':filename, 'value': filename} for filename in list(data_dict)]
+                    id={'type':'input-col', 'plot':trigger_type, 'input_id':f'{key}-col-dd', 'panel':'data'},
+                    className='col-8'
                 )
             ]
         ), 
-        html.Br(),
+        html.Br()
+    ]
+
+def make_data_panel(trigger_type, data_dict, *arg):
+    ### Panes that are not charts (text, title) keep the bar chart's inputs
+    chart = CHARTS.get(trigger_type, CHARTS[DEFAULT_CHART])
+    columns = []
+    for key in chart.columns:
+        columns += make_column_select(trigger_type, chart, key)
+        if key == 'x':
+            columns.insert(-1, dbc.FormText(id={'type':'input-warning', 'plot':trigger_type, 'input_id':'x-warning', 'panel':'data'}, color='danger'))
+    aggregate = [
         dbc.InputGroup(
             [
-                dbc.Label('X', className='col-3'), 
+                dbc.Label('Aggregate', className='col-3'), 
                 dbc.Select(
-                    id={'type':'input-col', 'plot':trigger_type, 'input_id':'x-col-dd', 'panel':'data'},
-                    className='col-8'
+                    id={'type':'input-agg', 'plot':trigger_type, 'input_id':'agg-dd', 'panel':'data'},
+                    className='col-8',
+                    options=[{'label':how, 'value':how} for how in chart.aggregations],
+                    value=chart.aggregations[0]
                 )
             ]
-        ), 
-        html.Br(),
+        )
+    ] if chart.aggregations else []
+
+    return [
         dbc.InputGroup(
             [
-                dbc.Label('Y', className='col-3'), 
+                dbc.Label('Data', className='col-3'), 
                 dbc.Select(
-                    id={'type':'input-col', 'plot':trigger_type, 'input_id':'y-col-dd', 'panel':'data'},
-                    className='col-8'
+                    id={'type':'input', 'plot':trigger_type, 'input_id':'data-dd', 'panel':'data'}, 
+                    className='col-8',
+                    options = [{'label':filename, 'value': filename} for filename in list(data_dict)]
                 )
             ]
-        )
-    ]
+        ), 
+        html.Br()
+    ] + columns + aggregate
 
 def make_text_panel(trigger_type, *arg):
     return [
@@ -103,28 +121,12 @@ def make_text_panel(trigger_type, *arg):
 
 
 modal_dict = {
-    'bar-chart': {
-        'accordion':[
-            ['Data', make_data_panel], 
-            ['Text', make_text_panel]#, 
-            #['Specifics', make_data_panel], 
-            #['Callbacks', make_text_panel]
-        ]
-    },
     'text': {
         'accordion':[
             ['Text', make_text_panel], 
             ['Specifics', make_data_panel]
         ]
     },
-    'pie-chart': {
-        'accordion':[
-            ['Data', make_data_panel], 
-            ['Text', make_text_panel], 
-            ['Specifics', make_data_panel], 
-            ['Callbacks', make_text_panel]
-        ]
-    },
     'title': {
         'accordion':[
             ['Specifics', make_data_panel], 
@@ -133,12 +135,44 @@ modal_dict = {
     },
 }
 
+### Every chart type gets the same pane, make_data_panel adapts it to the chart's columns
+for chart_type in CHARTS:
+    modal_dict[chart_type] = {
+        'accordion':[
+            ['Data', make_data_panel], 
+            ['Text', make_text_panel]#, 
+            #['Specifics', make_data_panel], 
+            #['Callbacks', make_text_panel]
+        ]
+    }
+
 def populate_body(trigger_action, trigger_type, data_dict=None, id=None, current_body=None):
     control_panel = html.Div(
-                        [make_accordion_item(panel[0], panel[1](trigger_type,data_dict)) for panel in modal_dict[trigger_type]['accordion']],
+                        [make_accordion_item(panel[0], panel[1](trigger_type,data_dict), key=f'{trigger_type}-{panel[0]}') for panel in modal_dict[trigger_type]['accordion']],
                         className="accordion"
                 )
     return dbc.Row([
+        dcc.Store(id={'type':'modal-data', 'plot':trigger_type}),
         dbc.Col(dcc.Graph(id={'id':'new-plot', 'plot':trigger_type, 'type':'modal'}, figure=go.Figure(data=[], layout={})), width=8),
         dbc.Col(control_panel, width=4, style={'overflowY':'scroll', 'height': '450px'})
-    ])
\ No newline at end of file
+    ])
+
+### Modal bodies for every element type, built once per dataset listing. They all live in the
+### layout and update_modal only switches which one is visible.
+pane_cache = {}
+
+def populate_panes(data_dict):
+    listing = tuple(data_dict)
+    panes = pane_cache.get(listing)
+    if panes is None:
+        panes = [
+            html.Div(
+                id={'type':'modal-pane', 'plot':trigger_type},
+                style={'display':'none'},
+                children=populate_body(trigger_action='create', trigger_type=trigger_type, data_dict=data_dict)
+            )
+            for trigger_type in modal_dict
+        ]
+        pane_cache.clear()
+        pane_cache[listing] = panes
+    return panes
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from store_functions_v1 import atomic_write_json
+
+# Opens count half as much after this many seconds, so the ranking follows recent use
+ACCESS_HALF_LIFE = 24 * 3600
+
+
+def decay(score, since, now, half_life=ACCESS_HALF_LIFE):
+    return score * 0.5 ** (max(0.0, now - since) / half_life)
+
+
+class AccessCounter:
+    # Exponentially decayed open counts per dashboard. record() only touches memory;
+    # flush() merges the new opens into a JSON file at path, so the ranking survives restarts
+    # and is shared by all workers. Two workers flushing at the same moment can lose a few
+    # opens, which is fine for a ranking.
+
+    def __init__(self, path=None, half_life=ACCESS_HALF_LIFE):
+        self.path = path
+        self.half_life = half_life
+        self._lock = threading.Lock()
+        self._stored = {}
+        self._pending = {}
+        if path:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self._stored = self._read()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r') as f:
+                return {name: tuple(entry) for name, entry in json.load(f).items()}
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _merge(self, *counts, now):
+        merged = {}
+        for count in counts:
+            for name, (score, since) in count.items():
+                merged[name] = merged.get(name, 0.0) + decay(score, since, now, self.half_life)
+        return {name: (score, now) for name, score in merged.items()}
+
+    def record(self, name, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            score, since = self._pending.get(name, (0.0, now))
+            self._pending[name] = (decay(score, since, now, self.half_life) + 1, now)
+
+    def scores(self, now=None):
+        now = time.time() if now is None else now
+        with self._lock:
+            return {name: score for name, (score, _) in self._merge(self._stored, self._pending, now=now).items()}
+
+    def ranked(self, limit=None):
+        scores = self.scores()
+        return sorted(scores, key=lambda name: -scores[name])[:limit]
+
+    def flush(self):
+        if not self.path:
+            return
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            stored = self._merge(self._read(), pending, now=time.time())
+            self._stored = stored
+        atomic_write_json(self.path, {name: list(entry) for name, entry in stored.items()})
+
+
+class PrewarmScheduler:
+    # Background thread that warms the caches of the most opened dashboards, highest ranked
+    # first: once when started, whenever trigger() is called and whenever changed() (checked
+    # every interval seconds) reports new data. The names in always are warmed as well, so a
+    # fresh deploy without any recorded opens still warms something. warm(name) runs on at
+    # most max_workers threads, so live requests keep most of the process.
+
+    def __init__(self, warm, access, changed=None, interval=60, max_workers=2, limit=10, always=()):
+        self.warm = warm
+        self.access = access
+        self.changed = changed
+        self.interval = interval
+        self.max_workers = max_workers
+        self.limit = limit
+        self.always = always
+        self.runs = 0
+        self.warmed = 0
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._wake.set()
+            self._thread = threading.Thread(target=self._loop, name='prewarm', daemon=True)
+            self._thread.start()
+        return self
+
+    def trigger(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            triggered = self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                if triggered or (self.changed is not None and self.changed()):
+                    self.run_once()
+            except Exception:
+                traceback.print_exc()
+
+    def run_once(self):
+        self.access.flush()
+        names = self.access.ranked(self.limit)
+        names += [name for name in self.always if name not in names]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='prewarm') as pool:
+            warmed = sum(pool.map(self._warm_one, names))
+        self.runs += 1
+        self.warmed += warmed
+        return names
+
+    def _warm_one(self, name):
+        try:
+            self.warm(name)
+            return 1
+        except Exception:
+            traceback.print_exc()
+            return 0
@@ -0,0 +1,139 @@
+import os
+import json
+import html
+import hashlib
+import threading
+import traceback
+from figure_functions_v1 import cached_figure
+from element_functions_v1 import InvalidElement
+from chart_functions_v1 import point_budget
+
+# Route read-only viewers open saved dashboards on, <VIEW_ROUTE><name>
+VIEW_ROUTE = '/view/'
+
+# Bumped whenever render_snapshot's output changes, so older cached snapshots are not reused
+SNAPSHOT_FORMAT = 2
+
+SNAPSHOT_PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+<style>
+body {{margin: 0}}
+.snapshot {{position: relative; height: 100vh; width: 100vw}}
+.snapshot > * {{position: absolute; box-sizing: border-box; margin: 0; overflow: hidden}}
+</style>
+{plotly}
+</head>
+<body>
+<div class="snapshot">
+{body}
+</div>
+<script>
+document.querySelectorAll('.snapshot-graph').forEach(function(element) {{
+    var figure = JSON.parse(element.nextElementSibling.textContent)
+    Plotly.newPlot(element, figure['data'], figure['layout'], {{'responsive': true}})
+}})
+</script>
+</body>
+</html>
+'''
+
+
+def element_style(element, border='1px black solid'):
+    style = dict(element.style(), border=border)
+    return html.escape('; '.join(f'{prop}: {value}' for prop, value in style.items() if value), quote=True)
+
+
+def script_json(data):
+    # JSON inside a <script> block must not be able to close it
+    return json.dumps(data).replace('</', '<\\/')
+
+
+def render_element(element, data_dict):
+    if isinstance(element, InvalidElement):
+        raise ValueError(element.error)
+    elif element.graph:
+        figure = cached_figure(element.data, element.layout, data_dict)
+        return (
+            f'<div class="snapshot-graph" style="{element_style(element)}"></div>'
+            f'<script type="application/json">{script_json(figure)}</script>'
+        )
+    else:
+        return f'<{element.type} style="{element_style(element)}">{html.escape(element.text)}</{element.type}>'
+
+
+def render_snapshot(layout, data_dict):
+    # The body of a snapshot page: every element at its saved position, graphs with their
+    # full (aggregated) figure inlined. A bad element becomes an error box, as in createBody.
+    rendered = []
+    for element in layout:
+        try:
+            rendered.append(render_element(element, data_dict))
+        except Exception as error:
+            traceback.print_exc()
+            message = html.escape(f'Could not render {element.id}: {error!r}')
+            rendered.append(f"<div style=\"{element_style(element, '1px red solid')}\">{message}</div>")
+    return '\n'.join(rendered)
+
+
+def snapshot_page(title, body, plotly_script):
+    return SNAPSHOT_PAGE.format(title=html.escape(title), plotly=plotly_script, body=body)
+
+
+def dataset_versions(layout, data_dict):
+    versions = {}
+    for element in layout:
+        if element.graph:
+            dataset = element.data['df']
+            try:
+                versions[dataset] = data_dict.version(dataset)
+            except (KeyError, OSError):
+                versions[dataset] = None
+    return versions
+
+
+def snapshot_key(name, layout_version, layout, data_dict):
+    # Changes with the saved layout, with any dataset one of its graphs reads and with the point budget
+    parts = [SNAPSHOT_FORMAT, name, layout_version, sorted(dataset_versions(layout, data_dict).items(), key=str), point_budget.key()]
+    return hashlib.sha1(json.dumps(parts, default=str).encode()).hexdigest()
+
+
+class SnapshotCache:
+    # Rendered snapshot bodies on disk, cache_dir/<name>-<key>.html. Only the newest
+    # snapshot of each dashboard is kept, older ones are removed when a new one is written.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, name, key):
+        return os.path.join(self.cache_dir, f'{name}-{key}.html')
+
+    def get(self, name, key, render):
+        path = self.path(name, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.hits += 1
+                return f.read()
+        except FileNotFoundError:
+            self.misses += 1
+
+        body = render()
+        tmp_path = f'{path}.tmp{os.getpid()}-{threading.get_ident()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.html') and filename[:-5].rpartition('-')[0] == name and filename != os.path.basename(path):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, filename))
+                    except FileNotFoundError:
+                        pass
+        return body
@@ -0,0 +1,272 @@
+import os
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from data_functions_v1 import MAX_POINTS, MAX_CATEGORIES, lttb, column_info, histogram_edges, reduce_grid
+
+# Aggregations as SQL, matching aggregate_xy (sum of an all-null group is 0, like pandas)
+SQL_AGGREGATIONS = {
+    'sum': 'COALESCE(SUM({y}), 0)',
+    'mean': 'AVG({y})',
+    'count': 'COUNT({y})'
+}
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def sqlite_affinity(declared_type):
+    # https://www.sqlite.org/datatype3.html#determination_of_column_affinity
+    declared_type = (declared_type or '').upper()
+    if 'INT' in declared_type:
+        return 'int64'
+    elif any(text in declared_type for text in ('CHAR', 'CLOB', 'TEXT')) or declared_type == '' or 'BLOB' in declared_type:
+        return 'object'
+    else:
+        return 'float64'
+
+
+class ConnectionPool:
+    # Fixed number of connections handed out one thread at a time; connect is called lazily
+    # until size connections exist, after which callers wait for one to be returned
+
+    def __init__(self, connect, size=4):
+        self.connect = connect
+        self.size = size
+        self._created = 0
+        self._lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+
+    @contextmanager
+    def connection(self):
+        conn = self._acquire()
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                return self.connect()
+        return self._idle.get()
+
+    def after_fork(self):
+        # Connections opened by the parent process must not be used by a forked child
+        with self._lock:
+            self._idle = queue.LifoQueue()
+            self._created = 0
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class SQLiteDataSource(Mapping):
+    # Every table of a SQLite database as a dataset, named after the table. Charts never
+    # pull the table into pandas: aggregate() runs a GROUP BY in the database and only
+    # the grouped rows come back. Query results are kept in an LRU keyed by the
+    # database version, so they are dropped as soon as anything writes to the file.
+
+    def __init__(self, path, pool_size=4, query_cache_entries=256):
+        self.path = path
+        self.pool = ConnectionPool(lambda: sqlite3.connect(path, check_same_thread=False, timeout=30), pool_size)
+        self.query_cache_entries = query_cache_entries
+        self._lock = threading.Lock()
+        self._query_cache = OrderedDict()
+        self._schemas = {}
+        self._versions = {}
+        self._metadata = {}
+        self.scan()
+
+    def database_version(self):
+        # WAL mode writes land in <path>-wal until a checkpoint, so both files count
+        parts = []
+        for path in (self.path, f'{self.path}-wal'):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            parts.append(f'{stat.st_size}-{stat.st_mtime_ns}')
+        return '-'.join(parts)
+
+    def scan(self):
+        version = self.database_version()
+        schemas = {}
+        for table in self.query("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name", cache=False):
+            columns = self.query(f'PRAGMA table_info({quote_identifier(table[0])})', cache=False)
+            schemas[table[0]] = [(column[1], column[2]) for column in columns]
+
+        with self._lock:
+            changed = {table for table in set(schemas) | set(self._versions) if table not in schemas or self._versions.get(table) != version}
+            self._schemas = schemas
+            self._versions = {table: version for table in schemas}
+            for table in changed:
+                self._metadata.pop(table, None)
+        return changed
+
+    def versions(self):
+        with self._lock:
+            return dict(self._versions)
+
+    def version(self, table):
+        if table not in self._schemas:
+            raise KeyError(table)
+        return self.database_version()
+
+    def columns(self, table):
+        return [name for name, _ in self._schemas[table]]
+
+    def query(self, sql, params=(), cache=True):
+        key = (self.database_version(), sql, tuple(params))
+        if cache:
+            with self._lock:
+                if key in self._query_cache:
+                    self._query_cache.move_to_end(key)
+                    return self._query_cache[key]
+
+        with self.pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+
+        if cache:
+            with self._lock:
+                self._query_cache[key] = rows
+                while len(self._query_cache) > self.query_cache_entries:
+                    self._query_cache.popitem(last=False)
+        return rows
+
+    def metadata(self, table):
+        version = self.version(table)
+        with self._lock:
+            cached = self._metadata.get(table)
+            if cached is not None and cached['version'] == version:
+                return cached
+
+        quoted_table = quote_identifier(table)
+        columns = []
+        for name, declared_type in self._schemas[table]:
+            dtype = sqlite_affinity(declared_type)
+            column = quote_identifier(name)
+            cardinality, low, high = self.query(f'SELECT COUNT(DISTINCT {column}), MIN({column}), MAX({column}) FROM {quoted_table}')[0]
+            numeric = dtype != 'object'
+            columns.append({
+                'name': name,
+                'dtype': dtype,
+                'numeric': numeric,
+                'cardinality': int(cardinality),
+                'min': None if not numeric or low is None else float(low),
+                'max': None if not numeric or high is None else float(high)
+            })
+        metadata = {'rows': int(self.query(f'SELECT COUNT(*) FROM {quoted_table}')[0][0]), 'columns': columns, 'version': version}
+
+        with self._lock:
+            self._metadata[table] = metadata
+        return metadata
+
+    def aggregate(self, table, x, y, how='sum', max_points=MAX_POINTS):
+        # Same result as aggregate_xy. Numeric x comes back sorted and is reduced with LTTB;
+        # categorical x keeps its first-seen order and the largest max_points groups are
+        # picked in the database.
+        columns = dict(self._schemas[table])
+        if x not in columns or y not in columns:
+            raise KeyError(x if x not in columns else y)
+
+        value = SQL_AGGREGATIONS[how].format(y=quote_identifier(y))
+        quoted_x, quoted_table = quote_identifier(x), quote_identifier(table)
+        if sqlite_affinity(columns[x]) != 'object':
+            rows = self.query(f'SELECT {quoted_x}, {value} FROM {quoted_table} WHERE {quoted_x} IS NOT NULL GROUP BY {quoted_x} ORDER BY {quoted_x}')
+            x_values, y_values = np.array([row[0] for row in rows]), np.array([row[1] for row in rows], dtype=float)
+            if len(rows) > max_points:
+                return lttb(x_values.astype(float), y_values, max_points)
+            return x_values, y_values
+
+        rows = self.query(
+            f'SELECT x, value FROM ('
+            f'SELECT {quoted_x} AS x, {value} AS value, MIN(rowid) AS first_seen FROM {quoted_table} '
+            f'WHERE {quoted_x} IS NOT NULL GROUP BY {quoted_x} ORDER BY value DESC, first_seen LIMIT ?'
+            f') ORDER BY first_seen',
+            (max_points,)
+        )
+        return np.array([row[0] for row in rows], dtype=object), np.array([row[1] for row in rows], dtype=float)
+
+    def histogram(self, table, x, bins):
+        # Same bins as DataRegistry.histogram, counted with a GROUP BY on the bin number
+        edges = histogram_edges(*[column_info(self.metadata(table), x)[key] for key in ('min', 'max')], bins)
+        counts = np.zeros(max(len(edges) - 1, 0), dtype=np.int64)
+        if not len(edges):
+            return edges, counts
+        quoted_x = quote_identifier(x)
+        rows = self.query(
+            f'SELECT MIN(CAST(({quoted_x} - ?) / ? AS INTEGER), ?) AS bin, COUNT(*) FROM {quote_identifier(table)} '
+            f'WHERE {quoted_x} IS NOT NULL GROUP BY bin',
+            (float(edges[0]), float(edges[-1] - edges[0]) / bins, bins - 1)
+        )
+        for bin_number, count in rows:
+            counts[bin_number] += count
+        return edges, counts
+
+    def histogram2d(self, table, x, y, bins):
+        # Same cells as DataRegistry.histogram2d, counted with a GROUP BY on both bin numbers
+        metadata = self.metadata(table)
+        x_edges, y_edges = [histogram_edges(column_info(metadata, name)['min'], column_info(metadata, name)['max'], bins) for name in (x, y)]
+        counts = np.zeros((max(len(y_edges) - 1, 0), max(len(x_edges) - 1, 0)), dtype=np.int64)
+        if not len(x_edges) or not len(y_edges):
+            return x_edges, y_edges, counts
+        quoted_x, quoted_y = quote_identifier(x), quote_identifier(y)
+        rows = self.query(
+            f'SELECT MIN(CAST(({quoted_x} - ?) / ? AS INTEGER), ?) AS x_bin, MIN(CAST(({quoted_y} - ?) / ? AS INTEGER), ?) AS y_bin, COUNT(*) '
+            f'FROM {quote_identifier(table)} WHERE {quoted_x} IS NOT NULL AND {quoted_y} IS NOT NULL GROUP BY x_bin, y_bin',
+            (float(x_edges[0]), float(x_edges[-1] - x_edges[0]) / bins, bins - 1, float(y_edges[0]), float(y_edges[-1] - y_edges[0]) / bins, bins - 1)
+        )
+        for x_bin, y_bin, count in rows:
+            counts[y_bin, x_bin] += count
+        return x_edges, y_edges, counts
+
+    def sample(self, table, columns, max_rows):
+        # Every n-th row by rowid, so that about max_rows rows come back
+        step = max(1, -(-self.metadata(table)['rows'] // max_rows))
+        selected = ', '.join(quote_identifier(column) for column in columns)
+        rows = self.query(f'SELECT {selected} FROM {quote_identifier(table)} WHERE rowid % ? = 0 LIMIT ?', (step, max_rows))
+        return pd.DataFrame(rows, columns=columns)
+
+    def aggregate_grid(self, table, x, y, z, how='sum', max_categories=MAX_CATEGORIES):
+        quoted_x, quoted_y, quoted_z = quote_identifier(x), quote_identifier(y), quote_identifier(z)
+        rows = self.query(
+            f'SELECT {quoted_x}, {quoted_y}, COALESCE(SUM({quoted_z}), 0), COUNT({quoted_z}) FROM {quote_identifier(table)} '
+            f'WHERE {quoted_x} IS NOT NULL AND {quoted_y} IS NOT NULL GROUP BY {quoted_x}, {quoted_y}'
+        )
+        totals = pd.DataFrame(rows, columns=['x', 'y', 'sum', 'count']).set_index(['x', 'y'])
+        return reduce_grid(totals, how, max_categories)
+
+    def __getitem__(self, table):
+        # The whole table as a DataFrame, only for callers that really need every row
+        if table not in self._schemas:
+            raise KeyError(table)
+        with self.pool.connection() as conn:
+            return pd.read_sql_query(f'SELECT * FROM {quote_identifier(table)}', conn)
+
+    def __iter__(self):
+        return iter(self._schemas)
+
+    def __len__(self):
+        return len(self._schemas)
+
+    def __contains__(self, table):
+        return table in self._schemas
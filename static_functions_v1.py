@@ -0,0 +1,75 @@
+import os
+import gzip
+import hashlib
+import threading
+import brotli
+
+# Static files are compressed once at high levels, unlike callback responses. Brotli 11
+# would save another ~9% on plotly.min.js but takes 14s instead of 0.7s on the first request.
+STATIC_ENCODINGS = {
+    'br': lambda data: brotli.compress(data, quality=9),
+    'gzip': lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+}
+STATIC_EXTENSIONS = ('.js', '.css', '.map', '.json', '.svg', '.html', '.txt')
+
+# Smaller files are sent as they are
+STATIC_MIN_SIZE = 1024
+
+
+class PrecompressedStatic:
+    # Brotli and gzip copies of static files, written to cache_dir the first time a file
+    # (at a given version) is asked for and then served straight from disk. Keys include
+    # the file's version, so an edited asset never gets an old compressed copy.
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, key, encoding):
+        return os.path.join(self.cache_dir, f"{hashlib.sha1(key.encode()).hexdigest()}.{encoding}")
+
+    def get(self, key, encoding, load):
+        # load() returns the uncompressed bytes, it is only called on a cache miss
+        path = self.path(key, encoding)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+
+        compressed = STATIC_ENCODINGS[encoding](load())
+        tmp_path = f'{path}.tmp{os.getpid()}-{threading.get_ident()}'
+        with open(tmp_path, 'wb') as f:
+            f.write(compressed)
+        os.replace(tmp_path, path)
+        return compressed
+
+    def precompress_folder(self, folder):
+        # Compress every asset up front, e.g. before forking workers
+        compressed = []
+        for root, _, filenames in os.walk(folder):
+            for filename in filenames:
+                path = os.path.join(root, filename)
+                if not filename.endswith(STATIC_EXTENSIONS) or os.path.getsize(path) < STATIC_MIN_SIZE:
+                    continue
+                for encoding in STATIC_ENCODINGS:
+                    self.get(file_key(path), encoding, lambda: read_file(path))
+                compressed.append(path)
+        return compressed
+
+
+def file_key(path):
+    stat = os.stat(path)
+    return f'{os.path.abspath(path)}-{stat.st_size}-{stat.st_mtime_ns}'
+
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def choose_encoding(accept_encodings):
+    # accept_encodings is flask's request.accept_encodings
+    best = accept_encodings.best_match(list(STATIC_ENCODINGS))
+    return best if best and accept_encodings[best] else None
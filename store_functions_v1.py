@@ -0,0 +1,240 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import tempfile
+import threading
+from contextlib import contextmanager
+from element_functions_v1 import layout_record, layout_from_record, diff_record, diff_from_record
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+DASHBOARD_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+def check_name(name):
+    if not DASHBOARD_NAME.match(name or ''):
+        raise ValueError(f'Invalid dashboard name: {name!r}')
+    return name
+
+
+def atomic_write_json(path, data):
+    # Readers only ever see the old or the new file, never a half-written one
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-', suffix='.txt')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def apply_layout_diff(layout, diff):
+    # diff = {'changed': [element, ...], 'removed': [id, ...], 'order': [id, ...] (optional)}
+    elements = {element.id: element for element in layout}
+    order = [element.id for element in layout]
+    for element in diff.get('changed', []):
+        if element.id not in elements:
+            order.append(element.id)
+        elements[element.id] = element
+    removed = set(diff.get('removed', []))
+    order = diff.get('order') or order
+    return [elements[element_id] for element_id in order if element_id in elements and element_id not in removed]
+
+
+def replay_layout(entries, version):
+    # entries: [(version, layout record or {'diff': diff record}), ...] sorted by version
+    layout = None
+    for entry_version, entry in entries:
+        if entry_version > version:
+            break
+        layout = apply_layout_diff(layout or [], diff_from_record(entry['diff'])) if 'diff' in entry else layout_from_record(entry)
+    if layout is None:
+        raise KeyError(f'No version {version}')
+    return layout
+
+
+class FileLayoutStore:
+    # One file per dashboard, layouts/<name>.txt, holding {'layout': [...], 'version': n, 'schema': s}.
+    # Every full save also keeps a copy under layouts/history/<name>/<version>.txt, while
+    # apply_diff only logs the element diff as <version>.diff.txt. Loads are served from
+    # memory until the file's mtime changes.
+
+    def __init__(self, root='layouts'):
+        self.root = root
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._cache = {}
+        os.makedirs(os.path.join(root, 'history'), exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.root, f'{check_name(name)}.txt')
+
+    def history_path(self, name, version=None, kind=''):
+        directory = os.path.join(self.root, 'history', check_name(name))
+        return directory if version is None else os.path.join(directory, f'{version:06d}{kind}.txt')
+
+    def names(self):
+        return sorted(filename[:-4] for filename in os.listdir(self.root) if filename.endswith('.txt') and not filename.startswith('.'))
+
+    def load(self, name):
+        path = self.path(name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return [], 0
+
+        with self._lock:
+            cached = self._cache.get(name)
+            if cached is not None and cached[0] == mtime:
+                return cached[1], cached[2]
+
+        with open(path, 'r') as f:
+            stored_layout = json.load(f)
+        layout, version = layout_from_record(stored_layout), stored_layout.get('version', 0)
+
+        with self._lock:
+            self._cache[name] = (mtime, layout, version)
+        return layout, version
+
+    def save(self, name, layout):
+        with self._locked(name):
+            _, version = self.load(name)
+            version += 1
+            os.makedirs(self.history_path(name), exist_ok=True)
+            atomic_write_json(self.history_path(name, version), layout_record(layout, version=version, saved_at=time.time()))
+            atomic_write_json(self.path(name), layout_record(layout, version=version))
+        return version
+
+    def apply_diff(self, name, diff):
+        with self._locked(name):
+            layout, version = self.load(name)
+            os.makedirs(self.history_path(name), exist_ok=True)
+            if not self.versions(name):
+                # Dashboards saved before history existed need a base for load_version to replay from
+                atomic_write_json(self.history_path(name, version), layout_record(layout, version=version, saved_at=time.time()))
+            version += 1
+            atomic_write_json(self.history_path(name, version, '.diff'), {'diff': diff_record(diff), 'version': version, 'saved_at': time.time()})
+            atomic_write_json(self.path(name), layout_record(apply_layout_diff(layout, diff), version=version))
+        return version
+
+    def versions(self, name):
+        directory = self.history_path(name)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(int(filename.split('.')[0]) for filename in os.listdir(directory) if filename.endswith('.txt') and not filename.startswith('.'))
+
+    def load_version(self, name, version):
+        entries = []
+        for entry_version in self.versions(name):
+            full_path, diff_path = self.history_path(name, entry_version), self.history_path(name, entry_version, '.diff')
+            with open(full_path if os.path.exists(full_path) else diff_path, 'r') as f:
+                entries.append((entry_version, json.load(f)))
+        return replay_layout(entries, version)
+
+    @contextmanager
+    def _locked(self, name):
+        # Serialises saves to one dashboard across threads and, where fcntl exists, processes
+        with self._save_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.root, f'.{check_name(name)}.lock'), 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class SQLiteLayoutStore:
+    # Same interface as FileLayoutStore. The current layout of each dashboard lives in
+    # `current`; `history` keeps one row per save, holding either the full layout or the
+    # element diff. Loads are served from memory until the dashboard's version changes.
+
+    def __init__(self, path='layouts/layouts.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._cache = {}
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS current (name TEXT PRIMARY KEY, version INTEGER NOT NULL, layout TEXT NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS history ('
+                'name TEXT NOT NULL, version INTEGER NOT NULL, layout TEXT, diff TEXT, saved_at REAL NOT NULL, '
+                'PRIMARY KEY (name, version))'
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def names(self):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT name FROM current ORDER BY name')]
+
+    def load(self, name):
+        check_name(name)
+        with self._connect() as conn:
+            row = conn.execute('SELECT version FROM current WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return [], 0
+            version = row[0]
+
+            with self._lock:
+                cached = self._cache.get(name)
+                if cached is not None and cached[0] == version:
+                    return cached[1], version
+
+            row = conn.execute('SELECT version, layout FROM current WHERE name = ?', (name,)).fetchone()
+        version, layout = row[0], layout_from_record(json.loads(row[1]))
+
+        with self._lock:
+            self._cache[name] = (version, layout)
+        return layout, version
+
+    def save(self, name, layout):
+        return self._write(name, lambda current: (layout, json.dumps(layout_record(layout)), None))
+
+    def apply_diff(self, name, diff):
+        return self._write(name, lambda current: (apply_layout_diff(current, diff), None, json.dumps(diff_record(diff))))
+
+    def _write(self, name, update):
+        check_name(name)
+        with self._connect() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute('SELECT version, layout FROM current WHERE name = ?', (name,)).fetchone()
+            version, current = (row[0], layout_from_record(json.loads(row[1]))) if row else (0, [])
+            if row and not conn.execute('SELECT 1 FROM history WHERE name = ? LIMIT 1', (name,)).fetchone():
+                conn.execute('INSERT INTO history VALUES (?, ?, ?, NULL, ?)', (name, version, row[1], time.time()))
+            layout, history_layout, history_diff = update(current)
+            version += 1
+            conn.execute('INSERT INTO history VALUES (?, ?, ?, ?, ?)', (name, version, history_layout, history_diff, time.time()))
+            conn.execute('INSERT OR REPLACE INTO current VALUES (?, ?, ?)', (name, version, json.dumps(layout_record(layout))))
+        return version
+
+    def versions(self, name):
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute('SELECT version FROM history WHERE name = ? ORDER BY version', (check_name(name),))]
+
+    def load_version(self, name, version):
+        with self._connect() as conn:
+            rows = conn.execute(
+                'SELECT version, layout, diff FROM history WHERE name = ? AND version <= ? ORDER BY version',
+                (check_name(name), version)
+            ).fetchall()
+        entries = [(row[0], json.loads(row[1]) if row[1] is not None else {'diff': json.loads(row[2])}) for row in rows]
+        return replay_layout(entries, version)
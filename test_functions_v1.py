@@ -0,0 +1,195 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+import pytest
+from data_functions_v1 import DataRegistry, lttb
+from sql_functions_v1 import SQLiteDataSource
+from element_functions_v1 import ELEMENT_SCHEMA, Element, InvalidElement, default_template, upgrade_v1, parse_layout, layout_record, layout_from_record, diff_record
+from store_functions_v1 import apply_layout_diff, replay_layout
+
+# Regression checks for the pure functions saved layouts and chart data depend on.
+#
+#     python -m pytest -q test_functions_v1.py
+
+###############################################################################################################
+#                                                  Helpers                                                    #
+###############################################################################################################
+
+def make_element(element_id, top=10.0, text='text'):
+    return Element(element_id, 'p', top=top, left=5.0, height=10.0, width=20.0, text=text)
+
+def element_ids(layout):
+    return [element.id for element in layout]
+
+@pytest.fixture
+def sources(tmp_path):
+    # The same rows as a CSV (in memory and streamed) and as a SQLite table
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({
+        'category': rng.choice(['a', 'b', 'c', 'd'], 500),
+        'day': rng.integers(0, 50, 500),
+        'value': rng.normal(10, 3, 500).round(3)
+    })
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    df.to_csv(data_dir / 'rows.csv', index=False)
+    with sqlite3.connect(tmp_path / 'rows.db') as conn:
+        df.to_sql('rows', conn, index=False)
+    return [
+        (DataRegistry(str(data_dir)), 'rows.csv'),
+        (DataRegistry(str(data_dir), stream_threshold=0), 'rows.csv'),
+        (SQLiteDataSource(str(tmp_path / 'rows.db')), 'rows')
+    ]
+
+###############################################################################################################
+#                                                 Downsampling                                                #
+###############################################################################################################
+
+def test_lttb_keeps_short_series():
+    x, y = np.arange(5.0), np.arange(5.0)
+    sampled_x, sampled_y = lttb(x, y, 10)
+    assert sampled_x is x and sampled_y is y
+
+def test_lttb_keeps_endpoints_and_order():
+    x = np.arange(1000.0)
+    y = np.sin(x / 20)
+    sampled_x, sampled_y = lttb(x, y, 100)
+    assert len(sampled_x) == 100
+    assert sampled_x[0] == 0 and sampled_x[-1] == 999
+    assert np.all(np.diff(sampled_x) > 0)
+    assert np.array_equal(sampled_y, np.sin(sampled_x / 20))
+
+def test_lttb_keeps_spike():
+    x = np.arange(1000.0)
+    y = np.zeros(1000)
+    y[437] = 100
+    assert 437 in lttb(x, y, 50)[0]
+
+###############################################################################################################
+#                                                Layout records                                               #
+###############################################################################################################
+
+def test_upgrade_v1():
+    stored = {
+        'id': 'g', 'type': 'div', 'top': '12.5%', 'left': '0%', 'height': '40%', 'width': '33.333%',
+        'text': '', 'graph': True, 'layout': {'title': {'text': 'T'}, 'template': default_template()},
+        'data': {'df': 'test0.csv', 'x': 'food', 'y': 'counts', 'agg': 'sum'}
+    }
+    upgraded = upgrade_v1(stored)
+    assert [upgraded[key] for key in ('top', 'left', 'height', 'width')] == [12.5, 0.0, 40.0, 33.333]
+    assert upgraded['layout'] == {'title': {'text': 'T'}}
+    assert upgraded['data'] == stored['data']
+    text = upgrade_v1(dict(stored, type='p', graph=False, text='hi', layout='', data=''))
+    assert text['text'] == 'hi' and 'layout' not in text and 'data' not in text
+
+def test_parse_layout_keeps_invalid_elements_in_their_schema():
+    stored = [{'id': 'bad', 'type': 'div', 'top': '1%', 'left': '1%', 'height': '1%', 'width': '1%', 'graph': True, 'layout': {}, 'data': {'df': 'x.csv', 'chart': 'unknown'}}]
+    layout = parse_layout(stored, 1)
+    assert isinstance(layout[0], InvalidElement) and layout[0].schema == 1
+
+    record = layout_record(layout)
+    assert record['schema'] == ELEMENT_SCHEMA
+    reloaded = layout_from_record(record)
+    assert isinstance(reloaded[0], InvalidElement) and reloaded[0].schema == 1
+    assert reloaded[0].raw == dict(stored[0], schema=1)
+
+def test_layout_record_round_trip():
+    layout = [make_element('a'), make_element('b', top=33.3333)]
+    reloaded = layout_from_record(layout_record(layout))
+    assert [element.to_dict() for element in reloaded] == [element.to_dict() for element in layout]
+    assert reloaded[1].top == 33.33
+
+###############################################################################################################
+#                                                 Layout diffs                                                #
+###############################################################################################################
+
+def test_apply_layout_diff():
+    layout = [make_element('a'), make_element('b'), make_element('c')]
+    diff = {'changed': [make_element('b', top=50.0), make_element('d')], 'removed': ['a']}
+    applied = apply_layout_diff(layout, diff)
+    assert element_ids(applied) == ['b', 'c', 'd']
+    assert applied[0].top == 50.0
+
+def test_apply_layout_diff_order():
+    layout = [make_element('a'), make_element('b'), make_element('c')]
+    applied = apply_layout_diff(layout, {'changed': [], 'removed': ['b'], 'order': ['c', 'b', 'a']})
+    assert element_ids(applied) == ['c', 'a']
+
+def test_replay_layout():
+    base = [make_element('a'), make_element('b')]
+    first = {'changed': [make_element('a', text='changed')], 'removed': []}
+    second = {'changed': [make_element('c')], 'removed': ['b']}
+    entries = [
+        (1, layout_record(base, version=1)),
+        (2, {'diff': diff_record(first)}),
+        (3, {'diff': diff_record(second)})
+    ]
+    assert element_ids(replay_layout(entries, 1)) == ['a', 'b']
+    assert replay_layout(entries, 2)[0].text == 'changed'
+    replayed = replay_layout(entries, 3)
+    assert [element.to_dict() for element in replayed] == [element.to_dict() for element in apply_layout_diff(apply_layout_diff(base, first), second)]
+    with pytest.raises(KeyError):
+        replay_layout(entries, 0)
+
+###############################################################################################################
+#                                           Data sources agree                                                #
+###############################################################################################################
+
+@pytest.mark.parametrize('how', ['sum', 'mean', 'count'])
+@pytest.mark.parametrize('x', ['category', 'day'])
+def test_aggregate_matches_across_sources(sources, x, how):
+    (memory, name), *others = sources
+    expected_x, expected_y = memory.aggregate(name, x, 'value', how=how)
+    for source, other_name in others:
+        result_x, result_y = source.aggregate(other_name, x, 'value', how=how)
+        assert sorted(map(str, result_x)) == sorted(map(str, expected_x))
+        order, expected_order = np.argsort(result_x.astype(str)), np.argsort(expected_x.astype(str))
+        assert np.allclose(result_y[order].astype(float), expected_y[expected_order].astype(float))
+
+def test_aggregate_downsamples_alike(sources):
+    results = [source.aggregate(name, 'day', 'value', how='sum', max_points=10) for source, name in sources]
+    for result_x, result_y in results[1:]:
+        assert np.array_equal(result_x.astype(float), results[0][0].astype(float))
+        assert np.allclose(result_y, results[0][1])
+
+def test_histograms_match_across_sources(sources):
+    results = [source.histogram(name, 'value', 20) for source, name in sources]
+    for edges, counts in results:
+        assert counts.sum() == 500
+        assert np.allclose(edges, results[0][0]) and np.array_equal(counts, results[0][1])
+
+    grids = [source.histogram2d(name, 'day', 'value', 10) for source, name in sources]
+    for _, _, counts in grids:
+        assert counts.shape == (10, 10) and counts.sum() == 500
+        assert np.array_equal(counts, grids[0][2])
+
+@pytest.mark.parametrize('stream_threshold', [0, 256 * 1024 ** 2])
+def test_unlisted_datasets_are_not_read(tmp_path, stream_threshold):
+    (tmp_path / 'secret.csv').write_text('password\nhunter2\n')
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 'rows.csv').write_text('x,y\n1,2\n')
+    registry = DataRegistry(str(data_dir), cache_dir=str(tmp_path / 'cache'), stream_threshold=stream_threshold)
+    for read in (
+        lambda name: registry.metadata(name),
+        lambda name: registry.histogram(name, 'password', 10),
+        lambda name: registry.histogram2d(name, 'password', 'password', 10),
+        lambda name: registry.sample(name, ['password'], 10),
+        lambda name: registry.aggregate_grid(name, 'password', 'password', 'password')
+    ):
+        for name in ('../secret.csv', 'missing.csv'):
+            with pytest.raises(KeyError):
+                read(name)
+    assert not os.path.isdir(tmp_path / 'cache') or not any('secret' in name for name in os.listdir(tmp_path / 'cache'))
+
+def test_cache_entries_of_similar_names_are_kept(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    (data_dir / 's.csv').write_text('x,y\n1,2\n')
+    (data_dir / 's.csv-old.csv').write_text('x,y\n3,4\n')
+    registry = DataRegistry(str(data_dir), cache_dir=str(tmp_path / 'cache'))
+    registry['s.csv-old.csv']
+    registry['s.csv']
+    entries = sorted(os.listdir(tmp_path / 'cache'))
+    assert len(entries) == 2 and entries[1].startswith('s.csv-old.csv-')
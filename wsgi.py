@@ -0,0 +1,16 @@
+### Production entry point: gunicorn -c gunicorn.conf.py wsgi:server
+###
+### With preload_app (see gunicorn.conf.py) this module is imported once in the master
+### process. prewarm() writes the columnar cache of every dataset before the workers are
+### forked, so each worker memory-maps the same .npy files and the OS keeps one copy of the
+### data in the page cache for all of them. The assets are compressed here too, the workers then
+### serve them from the same files. The most opened dashboards are warmed once here as well,
+### each worker then keeps them warm in the background (see post_fork in gunicorn.conf.py).
+
+from app_v4 import app, data_dict, static_files, prewarmer
+
+data_dict.prewarm()
+static_files.precompress_folder(app.config.assets_folder)
+prewarmer.run_once()
+
+server = app.server